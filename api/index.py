@@ -1,15 +1,32 @@
 import os
 import sys
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
 from datetime import datetime
+import hmac
+import atexit
+import threading
+import time
 import uuid
+import cv2
+from concurrent.futures import ThreadPoolExecutor
 
 # أضف المسار حتى يتمكن من استيراد utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.preprocess import preprocess_fingerprint
 from utils.extract_features import extract_features
-from utils.match_fingerprint import match_fingerprint
+from utils.match_fingerprint import match_fingerprint, MATCH_THRESHOLD, POSSIBLE_MATCH_THRESHOLD
+from utils.storage import storage_from_config
+from utils.artifacts import ARTIFACT_MAX_AGE, artifact_etag, full_resolution_filename
+from utils.gallery import open_gallery
+from utils.search import search_image, read_probe, DEFAULT_TOP_K, DEFAULT_THRESHOLD
+from utils.sharding import ShardedGallery, DEFAULT_SHARD_TIMEOUT
+from utils.verification import EnrollmentCache, verify_image, DEFAULT_CACHE_SIZE
+from utils.tenprint import TenPrintRecord, compare_records, FINGER_NAMES
+from utils.frames import MULTI_PAGE_EXTENSIONS, frame_refs, load_frame, select_frames
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.admission import AdmissionController
+from utils.profiling import profiled
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -20,25 +37,154 @@ app = Flask(
 )
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24))
 
-app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, '../uploads')
-app.config['RESULTS_FOLDER'] = os.path.join(BASE_DIR, '../results')
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, '../uploads'))
+app.config['RESULTS_FOLDER'] = os.environ.get('RESULTS_FOLDER', os.path.join(BASE_DIR, '../results'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'tif', 'tiff'}
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['STORAGE_MAX_AGE'] = int(os.environ.get('STORAGE_MAX_AGE', 7 * 24 * 3600))
+app.config['STORAGE_SWEEP_INTERVAL'] = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60))
+app.config['STORAGE_MIN_IDLE'] = int(os.environ.get('STORAGE_MIN_IDLE', 300))
+app.config['STORAGE_SWEEP_IN_WORKERS'] = os.environ.get('STORAGE_SWEEP_IN_WORKERS') == '1'
+app.config['GALLERY_PATH'] = os.environ.get('GALLERY_PATH', os.path.join(BASE_DIR, '../gallery.fpg'))
+app.config['VERIFY_CACHE_SIZE'] = int(os.environ.get('VERIFY_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+app.config['GALLERY_SHARDS'] = int(os.environ.get('GALLERY_SHARDS', 0))
+app.config['GALLERY_SHARD_TIMEOUT'] = float(os.environ.get('GALLERY_SHARD_TIMEOUT', DEFAULT_SHARD_TIMEOUT))
+app.config['COMPUTE_BUDGET_SECONDS'] = float(os.environ.get('COMPUTE_BUDGET_SECONDS', 30))
+app.config['ADMISSION_MAX_CONCURRENT'] = int(os.environ.get('ADMISSION_MAX_CONCURRENT', os.cpu_count() or 1))
+app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 2 * app.config['ADMISSION_MAX_CONCURRENT']))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['TENPRINT_WORKERS'] = int(os.environ.get('TENPRINT_WORKERS', os.cpu_count() or 1))
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
+storage = storage_from_config(app.config)
+
+app.jinja_env.filters['full_resolution_name'] = full_resolution_filename
+
+gallery = None
+verification_cache = None
+sharded_gallery = None
+sharded_gallery_lock = threading.Lock()
+tenprint_pool = None
+
+admission = AdmissionController(app.config['ADMISSION_MAX_CONCURRENT'],
+                                app.config['ADMISSION_MAX_QUEUE'],
+                                app.config['ADMISSION_QUEUE_TIMEOUT'])
+
+def start_services():
+    """Start the storage sweeper, open the gallery and create the ten-print pool (once per server, not in shard processes)"""
+    global gallery, verification_cache, tenprint_pool
+    if storage.min_idle <= app.config['COMPUTE_BUDGET_SECONDS']:
+        print("Warning: STORAGE_MIN_IDLE is not longer than COMPUTE_BUDGET_SECONDS; files of a running request may be evicted")
+    if not app.config['STORAGE_SWEEP_IN_WORKERS']:
+        storage.start()
+    gallery = open_gallery(app.config['GALLERY_PATH'])
+    verification_cache = EnrollmentCache(gallery, app.config['VERIFY_CACHE_SIZE']) if gallery is not None else None
+    tenprint_pool = ThreadPoolExecutor(max_workers=app.config['TENPRINT_WORKERS'], thread_name_prefix='tenprint')
+
+if __name__ != '__mp_main__':
+    start_services()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def match_result(score, inconclusive=False):
+    """Result text and Bootstrap alert type for a match score (inconclusive: the score is not comparable to the thresholds)"""
+    if inconclusive:
+        return "Inconclusive", "secondary"
+    if score >= MATCH_THRESHOLD:
+        return "Match Found!", "success"
+    elif score >= POSSIBLE_MATCH_THRESHOLD:
+        return "Possible Match", "warning"
+    return "No Match", "danger"
+
+def gallery_shards():
+    """Start the shard workers on first use, so every server process gets its own coordinator"""
+    global sharded_gallery
+    with sharded_gallery_lock:
+        if sharded_gallery is None:
+            sharded_gallery = ShardedGallery(app.config['GALLERY_PATH'], app.config['GALLERY_SHARDS'],
+                                             app.config['GALLERY_SHARD_TIMEOUT']).start()
+            atexit.register(sharded_gallery.stop)
+        return sharded_gallery
+
+def stored_frame(path, page):
+    """Upload filename of a selected frame: the uploaded image itself, or a new PNG of a TIFF page"""
+    if page is None:
+        return os.path.basename(path)
+    image = load_frame(path, page)
+    return storage.save_bytes(cv2.imencode('.png', image)[1].tobytes(), '.png', f"page {page + 1} of {os.path.basename(path)}")
+
+def prepare_capture(files, deadline):
+    """
+    Save the uploaded image(s) of one fingerprint; return (candidate filenames, frame selection).
+    A single still image is used as is. Several images or a multi-page TIFF
+    are treated as frames of one capture: every frame gets a cheap score and
+    only the best FRAMES_TO_MATCH become candidates for matching.
+    """
+    filenames = [storage.save_upload(f, secure_filename(f.filename)) for f in files]
+    if len(filenames) == 1 and os.path.splitext(filenames[0])[1] not in MULTI_PAGE_EXTENSIONS:
+        return filenames, None
+    refs = []
+    for filename in filenames:
+        refs.extend(frame_refs(os.path.join(app.config['UPLOAD_FOLDER'], filename)))
+    if len(refs) <= 1:
+        return filenames, None
+    best = select_frames(refs, deadline=deadline)
+    if not best:
+        return filenames, None
+    candidates = [stored_frame(*refs[index]) for index, _ in best]
+    return candidates, {'frames': len(refs), 'selected': [dict(score, frame=index + 1) for index, score in best]}
+
+def frame_pairs(count1, count2):
+    """Candidate pairs to match: best frame with best frame, then the runners-up"""
+    pairs = [(0, 0)]
+    runners_up = (min(1, count1 - 1), min(1, count2 - 1))
+    if runners_up != (0, 0):
+        pairs.append(runners_up)
+    return pairs
+
+def describe_frame(label, selection, index):
+    if selection is None:
+        return None
+    chosen = selection['selected'][index]
+    return f"{label}: frame {chosen['frame']} of {selection['frames']} (frame score {chosen['score']})"
+
+def profiling_requested():
+    """Profiling is opt-in per request via the X-Profile header or ?profile=<PROFILE_TOKEN>"""
+    token = app.config['PROFILE_TOKEN']
+    supplied = request.headers.get('X-Profile') or request.args.get('profile')
+    return bool(token) and supplied is not None and hmac.compare_digest(supplied.encode(), token.encode())
+
+def save_profile(profiler):
+    """Save a request profile next to the results and return its filenames"""
+    if profiler is None:
+        return None
+    stem = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{str(uuid.uuid4())[:8]}"
+    profile_files = profiler.save(app.config['RESULTS_FOLDER'], stem)
+    storage.register(*(os.path.join(app.config['RESULTS_FOLDER'], f) for f in profile_files))
+    print(f"Saved profile: {', '.join(profile_files)}")
+    return profile_files
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def send_artifact(folder, filename):
+    """Serve an immutable upload/result with a strong ETag and long-lived caching"""
+    with storage.serving(folder, filename):
+        response = send_from_directory(folder, filename, etag=artifact_etag(filename), max_age=ARTIFACT_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        return send_artifact(app.config['UPLOAD_FOLDER'], filename)
     except Exception as e:
         print(f"Error serving uploaded file {filename}: {str(e)}")
         return "File not found", 404
@@ -46,57 +192,224 @@ def uploaded_file(filename):
 @app.route('/results/<filename>')
 def result_file(filename):
     try:
-        return send_from_directory(app.config['RESULTS_FOLDER'], filename)
+        return send_artifact(app.config['RESULTS_FOLDER'], filename)
     except Exception as e:
         print(f"Error serving result file {filename}: {str(e)}")
         return "File not found", 404
 
+@app.route('/status')
+def status():
+    return jsonify({
+        'worker': os.getpid(),
+        'admission': admission.stats(),
+        'verification_cache': verification_cache.stats() if verification_cache is not None else None,
+        'gallery_shards': sharded_gallery.health() if sharded_gallery is not None else None,
+    })
+
+@app.route('/search', methods=['POST'])
+@admission.limit
+def search():
+    """1:N search of the uploaded fingerprint against the enrolled gallery, returns the ranked top k as JSON"""
+    if gallery is None:
+        return jsonify({'error': 'No gallery loaded'}), 404
+    file = request.files.get('fingerprint')
+    if file is None or file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'Upload a fingerprint image in the "fingerprint" field'}), 400
+    try:
+        k = int(request.form.get('k', DEFAULT_TOP_K))
+        threshold = float(request.form.get('threshold', DEFAULT_THRESHOLD))
+    except ValueError:
+        return jsonify({'error': 'k and threshold must be numbers'}), 400
+    try:
+        filename = storage.save_upload(file, secure_filename(file.filename))
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        gallery.refresh()
+        deadline = Deadline(app.config['COMPUTE_BUDGET_SECONDS'])
+        profiler = None
+        try:
+            with profiled(profiling_requested()) as profiler, storage.in_use(file_path):
+                if app.config['GALLERY_SHARDS'] > 0:
+                    results = gallery_shards().search(read_probe(file_path, deadline), k, threshold, deadline)
+                else:
+                    results = search_image(gallery, file_path, k, threshold, deadline)
+        finally:
+            profile_files = save_profile(profiler)
+        results['degradations'] = deadline.degradations
+        if profile_files:
+            results['profile_files'] = list(profile_files)
+        return jsonify(results)
+    except DeadlineExceeded as e:
+        return jsonify({'error': f'Search took too long and was stopped ({e.stage})'}), 503
+    except Exception as e:
+        print(f"Error searching gallery: {str(e)}")
+        return jsonify({'error': f'Error searching gallery: {str(e)}'}), 500
+
+@app.route('/verify', methods=['POST'])
+@admission.limit
+def verify():
+    """1:1 verification of the uploaded fingerprint against a claimed enrolled identity, returns JSON"""
+    if verification_cache is None:
+        return jsonify({'error': 'No gallery loaded'}), 404
+    identity = request.form.get('identity', '')
+    file = request.files.get('fingerprint')
+    if not identity:
+        return jsonify({'error': 'Missing "identity"'}), 400
+    if file is None or file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'Upload a fingerprint image in the "fingerprint" field'}), 400
+    gallery.refresh()
+    if identity not in gallery:
+        return jsonify({'error': f'Unknown identity {identity}'}), 404
+    try:
+        filename = storage.save_upload(file, secure_filename(file.filename))
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        deadline = Deadline(app.config['COMPUTE_BUDGET_SECONDS'])
+        profiler = None
+        try:
+            with profiled(profiling_requested()) as profiler, storage.in_use(file_path):
+                score, probe_count, enrolled_count, good_matches_count, cache_hit = verify_image(
+                    verification_cache, identity, file_path, deadline)
+        finally:
+            profile_files = save_profile(profiler)
+        result_text, _ = match_result(score)
+        results = {
+            'identity': identity,
+            'score': round(score, 2),
+            'result': result_text,
+            'verified': score >= MATCH_THRESHOLD,
+            'probe_keypoints': probe_count,
+            'enrolled_keypoints': enrolled_count,
+            'good_matches': good_matches_count,
+            'cache_hit': cache_hit,
+        }
+        if profile_files:
+            results['profile_files'] = list(profile_files)
+        return jsonify(results)
+    except DeadlineExceeded as e:
+        return jsonify({'error': f'Verification took too long and was stopped ({e.stage})'}), 503
+    except Exception as e:
+        print(f"Error verifying fingerprint: {str(e)}")
+        return jsonify({'error': f'Error verifying fingerprint: {str(e)}'}), 500
+
+@app.route('/tenprint', methods=['POST'])
+@admission.limit
+def tenprint():
+    """Compare two multi-finger records uploaded as probe_<finger> and reference_<finger> images, returns JSON"""
+    uploads = {'probe': {}, 'reference': {}}
+    for field, file in request.files.items():
+        side, _, finger = field.partition('_')
+        if side not in uploads or finger not in FINGER_NAMES:
+            return jsonify({'error': f'Unexpected field {field}, use probe_<finger> or reference_<finger>',
+                            'fingers': FINGER_NAMES}), 400
+        if file.filename == '' or not allowed_file(file.filename):
+            return jsonify({'error': f'Invalid file for {field}'}), 400
+        uploads[side][finger] = file
+    if not uploads['probe'] or not uploads['reference']:
+        return jsonify({'error': 'Upload at least one probe_<finger> and one reference_<finger> image',
+                        'fingers': FINGER_NAMES}), 400
+    try:
+        paths = {side: {finger: os.path.join(app.config['UPLOAD_FOLDER'],
+                                             storage.save_upload(file, secure_filename(file.filename)))
+                        for finger, file in files.items()}
+                 for side, files in uploads.items()}
+        all_paths = [path for files in paths.values() for path in files.values()]
+        deadline = Deadline(app.config['COMPUTE_BUDGET_SECONDS'])
+        profiler = None
+        try:
+            with profiled(profiling_requested()) as profiler, storage.in_use(*all_paths):
+                probe = TenPrintRecord.from_images(paths['probe'], tenprint_pool, deadline)
+                reference = TenPrintRecord.from_images(paths['reference'], tenprint_pool, deadline)
+                results = compare_records(probe, reference, tenprint_pool, deadline)
+        finally:
+            profile_files = save_profile(profiler)
+        results['result'], _ = match_result(results['score'])
+        results['matched'] = results['score'] >= MATCH_THRESHOLD
+        results['degradations'] = deadline.degradations
+        if profile_files:
+            results['profile_files'] = list(profile_files)
+        return jsonify(results)
+    except DeadlineExceeded as e:
+        return jsonify({'error': f'Matching took too long and was stopped ({e.stage})'}), 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error matching ten-print records: {str(e)}")
+        return jsonify({'error': f'Error matching records: {str(e)}'}), 500
+
 @app.route('/upload', methods=['POST'])
+@admission.limit
 def upload_file():
     if 'fingerprint1' not in request.files or 'fingerprint2' not in request.files:
         flash('No file part')
         return redirect(request.url)
-    file1 = request.files['fingerprint1']
-    file2 = request.files['fingerprint2']
-    if file1.filename == '' or file2.filename == '':
+    files1 = request.files.getlist('fingerprint1')
+    files2 = request.files.getlist('fingerprint2')
+    full_resolution = request.form.get('full_resolution') == 'on'
+    if any(f.filename == '' for f in files1 + files2):
         flash('No selected file')
         return redirect(request.url)
-    if file1 and file2 and allowed_file(file1.filename) and allowed_file(file2.filename):
+    if all(allowed_file(f.filename) for f in files1 + files2):
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_id = str(uuid.uuid4())[:8]
-            filename1 = f"{timestamp}_{unique_id}_1_{secure_filename(file1.filename)}"
-            filename2 = f"{timestamp}_{unique_id}_2_{secure_filename(file2.filename)}"
-            file1_path = os.path.join(app.config['UPLOAD_FOLDER'], filename1)
-            file2_path = os.path.join(app.config['UPLOAD_FOLDER'], filename2)
-            file1.save(file1_path)
-            file2.save(file2_path)
-            match_score, kp1_count, kp2_count, good_matches_count, match_filename, minutiae1_filename, minutiae2_filename, sourceafis_score = match_fingerprint(file1_path, file2_path, app.config['RESULTS_FOLDER'])
-            if match_filename is None or minutiae1_filename is None or minutiae2_filename is None:
+            deadline = Deadline(app.config['COMPUTE_BUDGET_SECONDS'])
+            candidates1, selection1 = prepare_capture(files1, deadline)
+            candidates2, selection2 = prepare_capture(files2, deadline)
+            paths1 = [os.path.join(app.config['UPLOAD_FOLDER'], f) for f in candidates1]
+            paths2 = [os.path.join(app.config['UPLOAD_FOLDER'], f) for f in candidates2]
+            profiler = None
+            attempts = []
+            try:
+                with profiled(profiling_requested()) as profiler, storage.in_use(*paths1, *paths2):
+                    for index1, index2 in frame_pairs(len(paths1), len(paths2)):
+                        if attempts:
+                            if any(result[0] >= MATCH_THRESHOLD and not capped for result, _, _, _, capped in attempts):
+                                break
+                            if not deadline.fits(attempts[0][3]):
+                                deadline.degrade('Matched only the best frame of each capture')
+                                break
+                        start = time.monotonic()
+                        was_capped = deadline.skipped('all_keypoints')
+                        try:
+                            result = match_fingerprint(paths1[index1], paths2[index2], app.config['RESULTS_FOLDER'], full_resolution, deadline)
+                        except ValueError as e:
+                            if not attempts:
+                                raise
+                            print(f"Runner-up frames not matched: {str(e)}")
+                            break
+                        attempts.append((result, index1, index2, time.monotonic() - start,
+                                         deadline.skipped('all_keypoints') and not was_capped))
+            finally:
+                profile_files = save_profile(profiler)
+            result_files = [f for result, *_ in attempts for f in result[4:7] if f]
+            if full_resolution:
+                result_files += [full_resolution_filename(f) for f in result_files]
+            storage.register(*(os.path.join(app.config['RESULTS_FOLDER'], f) for f in result_files))
+            result, index1, index2, _, capped = max(attempts, key=lambda attempt: attempt[0][0])
+            match_score, kp1_count, kp2_count, good_matches_count, match_filename, minutiae1_filename, minutiae2_filename, sourceafis_score = result
+            frame_notes = [note for note in (describe_frame('First fingerprint', selection1, index1),
+                                             describe_frame('Second fingerprint', selection2, index2)) if note]
+            if match_filename is None and not deadline.skipped('visualization'):
                 flash('Error processing images')
                 return redirect(url_for('index'))
-            if match_score >= 80:
-                result_text = "Match Found!"
-                result_type = "success"
-            elif match_score >= 50:
-                result_text = "Possible Match"
-                result_type = "warning"
-            else:
-                result_text = "No Match"
-                result_type = "danger"
+            result_text, result_type = match_result(match_score, inconclusive=capped)
             return render_template('result.html',
                                  score=match_score,
                                  result_text=result_text,
                                  result_type=result_type,
-                                 image1=filename1,
-                                 image2=filename2,
+                                 image1=candidates1[index1],
+                                 image2=candidates2[index2],
                                  match_image=match_filename,
                                  minutiae1_image=minutiae1_filename,
                                  minutiae2_image=minutiae2_filename,
                                  kp1_count=kp1_count,
                                  kp2_count=kp2_count,
                                  good_matches_count=good_matches_count,
-                                 sourceafis_score=sourceafis_score)
+                                 sourceafis_score=sourceafis_score,
+                                 full_resolution=full_resolution,
+                                 frame_notes=frame_notes,
+                                 degradations=deadline.degradations,
+                                 profile_files=profile_files)
+        except DeadlineExceeded as e:
+            flash(f'Processing took too long and was stopped ({e.stage}). Try smaller images.')
+            return redirect(url_for('index'))
         except Exception as e:
             flash(f'Error processing fingerprints: {str(e)}')
             return redirect(url_for('index'))
@@ -0,0 +1,74 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+Matching is CPU bound and holds the GIL for the Python parts, so the app
+scales with processes, not threads. Workers still run a few threads each:
+the admission controller (utils/admission.py) limits running matches across
+all workers, and a request can only be queued or rejected with a 503 once a
+worker thread has accepted it. The threads hold queued requests and answer
+rejections, while the compute limit stays at the admission limit. The
+admission slots are shared memory created by the preloaded app, so
+preload_app must stay on. The app is preloaded in the master:
+OpenCV, NumPy, scikit-image and the memory-mapped gallery are imported and
+opened once and then shared copy-on-write by every forked worker. No
+threads run in the master before it forks: the storage eviction thread is
+started in each worker instead, and the workers elect one of them to sweep.
+"""
+import os
+import multiprocessing
+
+
+def available_cores():
+    """CPU cores this process may run on (respects container/affinity limits)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def recommended_workers(cores=None):
+    """One worker per core is the best fit for CPU-bound matching"""
+    return max(1, cores or available_cores())
+
+
+cores = available_cores()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', recommended_workers(cores)))
+preload_app = True
+
+# Enough threads across the workers to hold every running and queued request,
+# plus one per worker to turn away the excess quickly
+admission_concurrent = int(os.environ.get('ADMISSION_MAX_CONCURRENT', cores))
+admission_queue = int(os.environ.get('ADMISSION_MAX_QUEUE', 2 * admission_concurrent))
+
+# Set before the app is preloaded: the app uses the same admission limits the
+# threads are sized for, and leaves the storage sweeper to post_fork
+raw_env = [
+    f'ADMISSION_MAX_CONCURRENT={admission_concurrent}',
+    f'ADMISSION_MAX_QUEUE={admission_queue}',
+    'STORAGE_SWEEP_IN_WORKERS=1',
+]
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', -(-(admission_concurrent + admission_queue) // workers) + 1))
+
+# Connections beyond what the threads hold wait in the kernel backlog; keep it
+# short so an overload shows up as refused connections, not minutes of latency
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 64))
+
+# A match on a 16MB image may take a while; recycle workers to bound memory growth
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+# OpenCV threads per worker, so that workers x threads does not oversubscribe the cores
+opencv_threads = int(os.environ.get('OPENCV_THREADS', max(1, cores // workers)))
+
+
+def post_fork(server, worker):
+    import cv2
+    cv2.setNumThreads(opencv_threads)
+    server.log.info(f"Worker {worker.pid}: cv2.setNumThreads({opencv_threads})")
+    from app import storage
+    storage.start()
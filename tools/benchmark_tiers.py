@@ -0,0 +1,141 @@
+"""
+Benchmark the speed/accuracy tiers of enhancement and analysis.
+
+Runs enhance_fingerprint and analyze_fingerprint at every tier on the given
+images (or on synthetic prints) and reports, per tier, the median latency,
+the speedup over the forensic tier and the effect on the results: the
+calculate_ridge_clarity of the enhanced image, and for analysis the pattern
+type agreement, minutiae count and ridge count.
+
+    python tools/benchmark_tiers.py
+    python tools/benchmark_tiers.py prints/*.png --repeat 5 --output tiers.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.fingerprint_enhancement import ENHANCEMENT_TIERS, enhance_fingerprint, calculate_ridge_clarity
+from utils.fingerprint_analysis import ANALYSIS_TIERS, analyze_fingerprint
+from utils.synthetic import synthetic_fingerprint
+
+REFERENCE_TIER = 'forensic'
+
+
+def synthetic_images(count, size, folder):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'synthetic_{i}.png')
+        cv2.imwrite(path, synthetic_fingerprint(i, impression=1, size=size))
+        paths.append(path)
+    return paths
+
+
+def timed(function, repeat):
+    """Run function repeat times; return (median seconds, last result)"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations)), result
+
+
+def benchmark_enhancement(paths, repeat):
+    per_tier = {}
+    for tier in ENHANCEMENT_TIERS:
+        seconds, clarity = [], []
+        for path in paths:
+            duration, result = timed(lambda: enhance_fingerprint(path, tier=tier), repeat)
+            seconds.append(duration)
+            clarity.append(calculate_ridge_clarity(result['enhanced']))
+        per_tier[tier] = {'seconds': seconds, 'ridge_clarity': clarity}
+        print(f"  enhance {tier}: {np.mean(seconds):.3f}s per image", file=sys.stderr)
+
+    reference = per_tier[REFERENCE_TIER]
+    return {tier: {
+        'median_seconds': round(float(np.median(values['seconds'])), 4),
+        'speedup': round(float(np.sum(reference['seconds']) / np.sum(values['seconds'])), 2),
+        'ridge_clarity': round(float(np.mean(values['ridge_clarity'])), 3),
+        'ridge_clarity_change_pct': round(float(
+            (np.mean(values['ridge_clarity']) - np.mean(reference['ridge_clarity']))
+            / max(np.mean(reference['ridge_clarity']), 1e-9) * 100), 1),
+    } for tier, values in per_tier.items()}
+
+
+def benchmark_analysis(paths, repeat):
+    per_tier = {}
+    for tier in ANALYSIS_TIERS:
+        seconds, patterns, minutiae, ridges = [], [], [], []
+        for path in paths:
+            duration, result = timed(lambda: analyze_fingerprint(path, tier=tier), repeat)
+            seconds.append(duration)
+            patterns.append(result['pattern_type'])
+            minutiae.append(sum(len(points) for points in result['minutiae_points'].values()))
+            ridges.append(result['ridges_analysis']['ridge_count'])
+        per_tier[tier] = {'seconds': seconds, 'patterns': patterns, 'minutiae': minutiae, 'ridges': ridges}
+        print(f"  analyze {tier}: {np.mean(seconds):.3f}s per image", file=sys.stderr)
+
+    reference = per_tier[REFERENCE_TIER]
+    return {tier: {
+        'median_seconds': round(float(np.median(values['seconds'])), 4),
+        'speedup': round(float(np.sum(reference['seconds']) / np.sum(values['seconds'])), 2),
+        'pattern_agreement': round(float(np.mean([a == b for a, b in zip(values['patterns'], reference['patterns'])])), 3),
+        'mean_minutiae': round(float(np.mean(values['minutiae'])), 1),
+        'mean_ridge_count': round(float(np.mean(values['ridges'])), 2),
+        'ridge_count_change_pct': round(float(
+            (np.mean(values['ridges']) - np.mean(reference['ridges']))
+            / max(np.mean(reference['ridges']), 1e-9) * 100), 1),
+    } for tier, values in per_tier.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark enhancement and analysis tiers')
+    parser.add_argument('images', nargs='*', help='fingerprint images (default: synthetic prints)')
+    parser.add_argument('--synthetic', type=int, default=6, help='number of synthetic prints when no images are given')
+    parser.add_argument('--size', type=int, nargs=2, default=[800, 640], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per image and tier (median is reported)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = args.images or synthetic_images(args.synthetic, tuple(args.size), folder)
+        print(f"Benchmarking {len(paths)} images, {args.repeat} runs each", file=sys.stderr)
+        report = {
+            'config': {
+                'images': len(paths),
+                'synthetic': not args.images,
+                'image_size': None if args.images else args.size,
+                'repeat': args.repeat,
+                'reference_tier': REFERENCE_TIER,
+            },
+            'enhancement': benchmark_enhancement(paths, args.repeat),
+            'analysis': benchmark_analysis(paths, args.repeat),
+        }
+
+    print(f"\n{'tier':<10} {'enhance s':>10} {'speedup':>8} {'clarity':>8} {'change':>8}"
+          f" {'analyze s':>10} {'speedup':>8} {'pattern':>8} {'ridges':>8}", file=sys.stderr)
+    for tier in ENHANCEMENT_TIERS:
+        e, a = report['enhancement'][tier], report['analysis'][tier]
+        print(f"{tier:<10} {e['median_seconds']:>10.3f} {e['speedup']:>7.1f}x {e['ridge_clarity']:>8.2f}"
+              f" {e['ridge_clarity_change_pct']:>7.1f}% {a['median_seconds']:>10.3f} {a['speedup']:>7.1f}x"
+              f" {a['pattern_agreement']:>8.0%} {a['ridge_count_change_pct']:>7.1f}%", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Enroll fingerprint images into a memory-mapped gallery file.
+
+    python tools/enroll.py gallery.fpg prints/alice.png prints/bob.png
+    python tools/enroll.py gallery.fpg --id alice-left-index scan.tif
+
+Identities default to the image file name without extension. The gallery is
+created on first use; later runs append without rewriting existing records.
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.gallery import create_gallery, enroll_image, Gallery
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Enroll fingerprints into a gallery file')
+    parser.add_argument('gallery', help='gallery file (created if missing)')
+    parser.add_argument('images', nargs='+', help='fingerprint images to enroll')
+    parser.add_argument('--id', dest='identity', help='identity for a single image')
+    parser.add_argument('--dtype', choices=['float32', 'uint8'], default='float32',
+                        help='descriptor storage type for a new gallery (uint8 is 4x smaller)')
+    args = parser.parse_args(argv)
+
+    if args.identity and len(args.images) != 1:
+        parser.error('--id can only be used with a single image')
+
+    if not os.path.exists(args.gallery):
+        create_gallery(args.gallery, args.dtype)
+        print(f"Created gallery {args.gallery} ({args.dtype} descriptors)")
+
+    failures = 0
+    for image_path in args.images:
+        identity = args.identity or os.path.splitext(os.path.basename(image_path))[0]
+        try:
+            count = enroll_image(args.gallery, identity, image_path)
+            print(f"Enrolled {identity}: {count} keypoints")
+        except Exception as e:
+            failures += 1
+            print(f"Error enrolling {image_path}: {str(e)}")
+
+    print(f"Gallery now holds {len(Gallery(args.gallery))} identities")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""
+Accuracy and throughput evaluation of fingerprint matchers.
+
+Scores every genuine pair (two prints of the same subject) and a sample of
+impostor pairs (prints of different subjects) with one or more matchers,
+using all cores, and reports the equal error rate, FMR/FNMR at the
+"Possible Match" and "Match Found!" thresholds of the upload page, and
+pairs per second.
+
+Labeled prints are read from one sub-folder per subject:
+
+    prints/alice/1.png  prints/alice/2.png  prints/bob/1.png ...
+
+    python tools/evaluate.py prints/ --matcher match_fingerprint --matcher opencv
+    python tools/evaluate.py --synthetic 40 --matcher sift --output eval.json
+    python tools/evaluate.py prints/ --matcher mypackage.matchers:score_pair
+    python tools/evaluate.py --synthetic 200 --search-recall
+
+A custom matcher is given as module:function and is called with two image
+paths; it must return a score from 0 to 100.
+
+A pair on which the matcher raises is a failure to match. FMR, FNMR and the
+EER are computed over the pairs that were compared, and the failure-to-match
+rate is reported separately. The generalized rates and EER count failed
+pairs as rejected at every threshold, so a failed genuine pair adds to the
+generalized FNMR.
+
+A matcher that gives every pair the same score (e.g. 0 when it finds no
+features at all) cannot separate genuine from impostor pairs. It is flagged
+as degenerate and gets no EER.
+
+--search-recall checks the 1:N search cascade instead: every subject's
+first print is enrolled in a temporary gallery, the other prints are
+searched, and the report gives how often the mate survives the lossy
+signature and vote stages and ends up first or in the top k.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+import itertools
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.match_fingerprint import (FingerprintMatcher, MATCH_THRESHOLD, POSSIBLE_MATCH_THRESHOLD,
+                                     calculate_match_score, extract_sift_features, match_descriptors,
+                                     match_fingerprint)
+from utils.gallery import Gallery, create_gallery, enroll_image
+from utils.search import DEFAULT_TOP_K, SIGNATURE_KEEP_FRACTION, SIGNATURE_MIN_KEEP, read_probe, search_gallery, shortlist
+from utils.synthetic import synthetic_fingerprint
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp'}
+REPORT_THRESHOLDS = (POSSIBLE_MATCH_THRESHOLD, MATCH_THRESHOLD)
+
+
+def sift_score(path1, path2):
+    """match_fingerprint's SIFT + FLANN + ratio test score without reading twice or drawing results"""
+    kp1, des1 = extract_sift_features(cv2.imread(path1, cv2.IMREAD_GRAYSCALE))
+    kp2, des2 = extract_sift_features(cv2.imread(path2, cv2.IMREAD_GRAYSCALE))
+    if des1 is None or des2 is None or len(des2) < 2:
+        raise ValueError("No features found in one or both images")
+    return calculate_match_score(len(match_descriptors(des1, des2)), len(kp1), len(kp2))
+
+
+def match_fingerprint_score(results_folder, path1, path2):
+    return match_fingerprint(path1, path2, results_folder)[0]
+
+
+# matcher name -> factory(results_folder) returning function(path1, path2) -> score
+MATCHERS = {
+    'match_fingerprint': lambda results_folder: partial(match_fingerprint_score, results_folder),
+    'sift': lambda results_folder: sift_score,
+    'opencv': lambda results_folder: partial(FingerprintMatcher().match_fingerprints, method='opencv'),
+    'nbis': lambda results_folder: partial(FingerprintMatcher().match_fingerprints, method='nbis'),
+}
+
+
+def resolve_matcher(name, results_folder):
+    if name in MATCHERS:
+        return MATCHERS[name](results_folder)
+    if ':' in name:
+        module, function = name.split(':', 1)
+        return getattr(importlib.import_module(module), function)
+    raise ValueError(f"Unknown matcher {name!r}; use one of {', '.join(MATCHERS)} or module:function")
+
+
+_matcher = None
+
+
+def _init_worker(name, results_folder):
+    global _matcher
+    # Parallelism comes from the worker processes
+    cv2.setNumThreads(1)
+    # The matchers log with print; keep stdout clean for the JSON report
+    sys.stdout = sys.stderr
+    _matcher = resolve_matcher(name, results_folder)
+
+
+def _score_pair(pair):
+    start = time.perf_counter()
+    try:
+        score = float(_matcher(*pair))
+        error = None
+    except Exception as e:
+        score, error = None, str(e)
+    return score, time.perf_counter() - start, error
+
+
+def load_subjects(folder):
+    """{subject: sorted image paths} from one sub-folder per subject"""
+    subjects = {}
+    for subject in sorted(os.listdir(folder)):
+        subject_folder = os.path.join(folder, subject)
+        if not os.path.isdir(subject_folder):
+            continue
+        images = sorted(os.path.join(subject_folder, name) for name in os.listdir(subject_folder)
+                        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        if images:
+            subjects[subject] = images
+    return subjects
+
+
+def write_synthetic_dataset(folder, subjects, impressions, size):
+    for subject in range(subjects):
+        subject_folder = os.path.join(folder, f'subject_{subject:04d}')
+        os.makedirs(subject_folder, exist_ok=True)
+        for impression in range(impressions):
+            image = synthetic_fingerprint(subject, impression=impression, size=size)
+            cv2.imwrite(os.path.join(subject_folder, f'{impression}.png'), image)
+
+
+def build_pairs(subjects, max_impostors, seed=0):
+    """All genuine pairs, and up to max_impostors impostor pairs between the subjects' first prints"""
+    genuine = [pair for images in subjects.values() for pair in itertools.combinations(images, 2)]
+    firsts = [images[0] for images in subjects.values()]
+    impostor = list(itertools.combinations(firsts, 2))
+    if max_impostors is not None and len(impostor) > max_impostors:
+        impostor = random.Random(seed).sample(impostor, max_impostors)
+    return genuine, impostor
+
+
+def error_rates(genuine, impostor, threshold):
+    """(FMR, FNMR) when scores >= threshold are accepted; failures (-inf), if any, are always rejected"""
+    fmr = float(np.mean(impostor >= threshold)) if len(impostor) else None
+    fnmr = float(np.mean(genuine < threshold)) if len(genuine) else None
+    return fmr, fnmr
+
+
+def equal_error_rate(genuine, impostor):
+    """Return (EER, threshold) where FMR and FNMR are closest; failures (-inf), if any, are always rejected"""
+    if not len(genuine) or not len(impostor):
+        return None, None
+    scores = np.concatenate([genuine, impostor])
+    thresholds = np.unique(np.concatenate([scores[np.isfinite(scores)], [np.inf]]))
+    sorted_genuine = np.sort(genuine)
+    sorted_impostor = np.sort(impostor)
+    fnmr = np.searchsorted(sorted_genuine, thresholds, side='left') / len(genuine)
+    fmr = 1 - np.searchsorted(sorted_impostor, thresholds, side='left') / len(impostor)
+    i = int(np.argmin(np.abs(fmr - fnmr)))
+    return float((fmr[i] + fnmr[i]) / 2), float(thresholds[i])
+
+
+def evaluate(name, genuine_pairs, impostor_pairs, workers, results_folder):
+    pairs = genuine_pairs + impostor_pairs
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(name, results_folder)) as pool:
+        results = list(pool.map(_score_pair, pairs, chunksize=max(1, len(pairs) // (workers * 8))))
+    elapsed = time.perf_counter() - start
+
+    errors = [error for _, _, error in results if error is not None]
+    # Failed pairs are -inf: left out of the compared arrays, rejected at every threshold in the generalized ones
+    scores = np.array([-np.inf if score is None else score for score, _, _ in results])
+    genuine = scores[:len(genuine_pairs)]
+    impostor = scores[len(genuine_pairs):]
+    genuine_scored = genuine[np.isfinite(genuine)]
+    impostor_scored = impostor[np.isfinite(impostor)]
+    genuine_ftm = float(np.mean(~np.isfinite(genuine))) if len(genuine) else None
+    impostor_ftm = float(np.mean(~np.isfinite(impostor))) if len(impostor) else None
+
+    compared = np.concatenate([genuine_scored, impostor_scored])
+    degenerate = bool(len(compared) and np.ptp(compared) == 0)
+    if degenerate:
+        print(f"  {name}: every compared pair scored {compared[0]:g}; no EER", file=sys.stderr)
+        eer = eer_threshold = generalized_eer = None
+    else:
+        eer, eer_threshold = equal_error_rate(genuine_scored, impostor_scored)
+        generalized_eer, _ = equal_error_rate(genuine, impostor)
+
+    thresholds = {}
+    for threshold in REPORT_THRESHOLDS:
+        fmr, fnmr = error_rates(genuine_scored, impostor_scored, threshold)
+        generalized_fmr, generalized_fnmr = error_rates(genuine, impostor, threshold)
+        thresholds[str(threshold)] = {'fmr': fmr, 'fnmr': fnmr,
+                                      'generalized_fmr': generalized_fmr, 'generalized_fnmr': generalized_fnmr}
+
+    return {
+        'matcher': name,
+        'genuine_pairs': len(genuine_pairs),
+        'impostor_pairs': len(impostor_pairs),
+        'errors': len(errors),
+        'genuine_failures': int(np.sum(~np.isfinite(genuine))),
+        'impostor_failures': int(np.sum(~np.isfinite(impostor))),
+        'failure_to_match_rate': round(len(errors) / len(results), 4) if results else None,
+        'genuine_failure_to_match_rate': round(genuine_ftm, 4) if genuine_ftm is not None else None,
+        'impostor_failure_to_match_rate': round(impostor_ftm, 4) if impostor_ftm is not None else None,
+        'error_examples': errors[:5],
+        'degenerate': degenerate,
+        'eer': round(eer, 4) if eer is not None else None,
+        'eer_threshold': round(eer_threshold, 2) if eer_threshold is not None else None,
+        'generalized_eer': round(generalized_eer, 4) if generalized_eer is not None else None,
+        'thresholds': thresholds,
+        'genuine_score_mean': round(float(genuine_scored.mean()), 2) if len(genuine_scored) else None,
+        'impostor_score_mean': round(float(impostor_scored.mean()), 2) if len(impostor_scored) else None,
+        'pairs_per_second': round(len(pairs) / elapsed, 3) if elapsed > 0 else None,
+        'mean_pair_seconds': round(float(np.mean([seconds for _, seconds, _ in results])), 4) if results else None,
+        'elapsed_s': round(elapsed, 2),
+    }
+
+
+def search_recall(subjects, k, workdir):
+    """Enroll each subject's first print, search with the others and count how often the mate survives each stage"""
+    gallery_path = os.path.join(workdir, 'gallery.fpg')
+    create_gallery(gallery_path)
+    for subject, images in subjects.items():
+        enroll_image(gallery_path, subject, images[0])
+    gallery = Gallery(gallery_path)
+    identities, signatures = gallery.signatures()
+    row_of = {identity: row for row, identity in enumerate(identities)}
+
+    hits = {'signature': 0, 'vote': 0, 'top_1': 0, 'top_k': 0}
+    signature_ranks = []
+    seconds = []
+    for subject, images in subjects.items():
+        for image_path in images[1:]:
+            probe = read_probe(image_path)
+            # Rank of the mate by signature similarity alone (0 = most similar)
+            similarity = signatures @ probe.orientation
+            signature_ranks.append(int(np.sum(similarity > similarity[row_of[subject]])))
+
+            start = time.perf_counter()
+            signature_survivors, vote_survivors, _ = shortlist(gallery, probe, k)
+            ranked = [candidate['identity'] for candidate in search_gallery(gallery, probe, k)['candidates']]
+            seconds.append(time.perf_counter() - start)
+
+            hits['signature'] += subject in signature_survivors
+            hits['vote'] += subject in vote_survivors
+            hits['top_1'] += bool(ranked) and ranked[0] == subject
+            hits['top_k'] += subject in ranked
+
+    probes = len(signature_ranks)
+    ranks = np.array(signature_ranks)
+    return {
+        'gallery_size': len(gallery),
+        'probes': probes,
+        'k': k,
+        'signature_keep': max(SIGNATURE_MIN_KEEP, int(np.ceil(len(gallery) * SIGNATURE_KEEP_FRACTION))),
+        'recall': {stage: round(count / probes, 4) if probes else None for stage, count in hits.items()},
+        'signature_rank': {
+            'median': float(np.median(ranks)) if probes else None,
+            'p95': float(np.percentile(ranks, 95)) if probes else None,
+            'max': int(ranks.max()) if probes else None,
+        },
+        'mean_search_seconds': round(float(np.mean(seconds)), 4) if seconds else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate matcher accuracy (EER, FMR/FNMR) and throughput')
+    parser.add_argument('dataset', nargs='?', help='folder with one sub-folder of prints per subject')
+    parser.add_argument('--synthetic', type=int, metavar='SUBJECTS',
+                        help='evaluate on this many synthetic subjects instead of a dataset')
+    parser.add_argument('--impressions', type=int, default=2, help='impressions per synthetic subject')
+    parser.add_argument('--size', type=int, nargs=2, default=[400, 320], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--matcher', action='append', dest='matchers',
+                        help=f"matcher to evaluate, repeatable: {', '.join(MATCHERS)} or module:function "
+                             "(default: match_fingerprint)")
+    parser.add_argument('--max-impostors', type=int, default=1000, help='impostor pairs to sample')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='impostor sampling seed')
+    parser.add_argument('--search-recall', action='store_true',
+                        help='check the recall of the 1:N search stages instead of scoring pairs')
+    parser.add_argument('--k', type=int, default=DEFAULT_TOP_K, help='top k for --search-recall')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if bool(args.dataset) == bool(args.synthetic):
+        parser.error('give either a dataset folder or --synthetic SUBJECTS')
+    matchers = args.matchers or ['match_fingerprint']
+    for name in matchers:
+        if name not in MATCHERS and ':' not in name:
+            parser.error(f"unknown matcher {name!r}")
+
+    with tempfile.TemporaryDirectory(prefix='fingerprint_eval_') as workdir:
+        dataset = args.dataset
+        if args.synthetic:
+            dataset = os.path.join(workdir, 'dataset')
+            write_synthetic_dataset(dataset, args.synthetic, args.impressions, tuple(args.size))
+        subjects = load_subjects(dataset)
+        if args.search_recall:
+            if not any(len(images) > 1 for images in subjects.values()):
+                parser.error('the dataset needs at least one subject with two or more prints')
+            print(f"Search recall: {len(subjects)} subjects enrolled, k={args.k}", file=sys.stderr)
+            return _write_report({
+                'config': {
+                    'dataset': None if args.synthetic else os.path.abspath(args.dataset),
+                    'synthetic_subjects': args.synthetic,
+                    'subjects': len(subjects),
+                },
+                'search_recall': search_recall(subjects, args.k, workdir),
+            }, args.output)
+        genuine_pairs, impostor_pairs = build_pairs(subjects, args.max_impostors, args.seed)
+        if not genuine_pairs:
+            parser.error('the dataset needs at least one subject with two or more prints')
+        print(f"{len(subjects)} subjects: {len(genuine_pairs)} genuine and {len(impostor_pairs)} impostor pairs, "
+              f"{args.workers} workers", file=sys.stderr)
+
+        results_folder = os.path.join(workdir, 'results')
+        os.makedirs(results_folder)
+        reports = []
+        for name in matchers:
+            print(f"Evaluating {name}...", file=sys.stderr)
+            report = evaluate(name, genuine_pairs, impostor_pairs, args.workers, results_folder)
+            print(f"  EER {report['eer']}{' (degenerate matcher)' if report['degenerate'] else ''}, "
+                  f"{report['pairs_per_second']} pairs/s, failures to match {report['errors']}", file=sys.stderr)
+            reports.append(report)
+
+    report = {
+        'config': {
+            'dataset': None if args.synthetic else os.path.abspath(args.dataset),
+            'synthetic_subjects': args.synthetic,
+            'subjects': len(subjects),
+            'workers': args.workers,
+            'thresholds': list(REPORT_THRESHOLDS),
+            'nbis_available': FingerprintMatcher().nbis_available if 'nbis' in matchers else None,
+        },
+        'matchers': reports,
+    }
+    return _write_report(report, args.output)
+
+
+def _write_report(report, output_path):
+    output = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(output)
+        print(f"Report written to {output_path}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+Local load test for the Flask app.
+
+Starts the app (development server or gunicorn), drives an endpoint with
+synthetic fingerprint pairs at one or more concurrency levels and writes a
+JSON report with latency percentiles, error rates, throughput and the RSS of
+the server processes over time. A started server stores its uploads and
+results in a temporary folder that is removed afterwards.
+
+503 responses are the admission controller turning requests away; they are
+counted as rejections, separately from errors, and do not fail the run.
+
+    python tools/loadtest.py --concurrency 1,2,4,8 --requests 40
+    python tools/loadtest.py --server gunicorn --workers 4 --output report.json
+    python tools/loadtest.py --url http://localhost:10000 --concurrency 4
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+from utils.synthetic import synthetic_pair, encode_png
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # The app reports errors by flashing and redirecting to the index page,
+    # so a redirect must count as a failed request, not be followed.
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def encode_multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_upload_request(pair_index, pair):
+    first, second = pair
+    return '/upload', {}, [
+        ('fingerprint1', f'probe_{pair_index}.png', first),
+        ('fingerprint2', f'reference_{pair_index}.png', second),
+    ]
+
+
+def build_search_request(pair_index, pair):
+    # Needs a server started with GALLERY_PATH pointing at an enrolled gallery
+    return '/search', {}, [('fingerprint', f'probe_{pair_index}.png', pair[0])]
+
+
+# endpoint name -> function(pair_index, (png1, png2)) returning (path, fields, files)
+SCENARIOS = {
+    'upload': build_upload_request,
+    'search': build_search_request,
+}
+
+
+def make_pairs(count, size):
+    pairs = []
+    for i in range(count):
+        first, second = synthetic_pair(i, genuine=(i % 2 == 0), size=size)
+        pairs.append((encode_png(first), encode_png(second)))
+    return pairs
+
+
+def send_request(base_url, path, fields, files, timeout):
+    body, content_type = encode_multipart(fields, files)
+    request = urllib.request.Request(base_url + path, data=body, method='POST',
+                                     headers={'Content-Type': content_type})
+    start = time.perf_counter()
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {
+        'p50': round(float(np.percentile(values, 50)), 1),
+        'p95': round(float(np.percentile(values, 95)), 1),
+        'p99': round(float(np.percentile(values, 99)), 1),
+        'mean': round(float(values.mean()), 1),
+        'max': round(float(values.max()), 1),
+    }
+
+
+def run_level(base_url, scenario, pairs, concurrency, total_requests, timeout):
+    """Send total_requests requests with the given concurrency and summarize them"""
+    def task(i):
+        path, fields, files = scenario(i % len(pairs), pairs[i % len(pairs)])
+        return send_request(base_url, path, fields, files, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(task, range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    status_counts = {}
+    for status, _ in results:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    ok = [latency for status, latency in results if status == 200]
+    rejected = sum(1 for status, _ in results if status == 503)
+    errors = len(results) - len(ok) - rejected
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else 0,
+        'rejected': rejected,
+        'rejection_rate': round(rejected / len(results), 4) if results else 0,
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed > 0 else 0,
+        'elapsed_s': round(elapsed, 2),
+        'latency_ms': percentiles(ok),
+        'status_counts': status_counts,
+    }
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Samples the RSS of the server process and its workers (Linux /proc)"""
+
+    def __init__(self, pid, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+        self._start = time.perf_counter()
+
+    def run(self):
+        if not os.path.exists('/proc'):
+            return
+        while not self._stopped.is_set():
+            per_process = {}
+            for pid in [self.pid] + _children(self.pid):
+                rss = _rss_kb(pid)
+                if rss is not None:
+                    per_process[str(pid)] = rss
+            self.samples.append({
+                't': round(time.perf_counter() - self._start, 2),
+                'total_rss_kb': sum(per_process.values()),
+                'rss_kb': per_process,
+            })
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def growth_per_process(self):
+        """RSS growth in KB between the first and last sample of every process"""
+        first, last = {}, {}
+        for sample in self.samples:
+            for pid, rss in sample['rss_kb'].items():
+                first.setdefault(pid, rss)
+                last[pid] = rss
+        return {pid: last[pid] - first[pid] for pid in first}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, port, workers, log_path, data_dir):
+    # Keep the test uploads and results out of the app's own folders
+    env = dict(os.environ, PORT=str(port),
+               UPLOAD_FOLDER=os.path.join(data_dir, 'uploads'),
+               RESULTS_FOLDER=os.path.join(data_dir, 'results'))
+    if kind == 'gunicorn':
+        if workers:
+            env['WEB_CONCURRENCY'] = str(workers)
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(log_path, 'w')
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + '/', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError("Server did not become ready in time")
+
+
+def saturation_point(levels, min_gain=0.05):
+    """Lowest concurrency after which throughput grows by less than min_gain"""
+    for previous, current in zip(levels, levels[1:]):
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 + min_gain):
+            return previous['concurrency']
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the fingerprint matching app')
+    parser.add_argument('--url', help='test a running server instead of starting one')
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='dev',
+                        help='server to start: python app.py or gunicorn -c gunicorn.conf.py')
+    parser.add_argument('--workers', type=int, help='gunicorn worker count (WEB_CONCURRENCY)')
+    parser.add_argument('--endpoint', choices=sorted(SCENARIOS), default='upload')
+    parser.add_argument('--concurrency', default='1,2,4', help='comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=20, help='requests per concurrency level')
+    parser.add_argument('--pairs', type=int, default=8, help='number of synthetic fingerprint pairs')
+    parser.add_argument('--size', type=int, nargs=2, default=[400, 320], metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--timeout', type=float, default=120, help='per-request timeout in seconds')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='RSS sampling interval in seconds')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    pairs = make_pairs(args.pairs, tuple(args.size))
+    scenario = SCENARIOS[args.endpoint]
+
+    process = None
+    data_dir = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        log_path = os.path.join(tempfile.gettempdir(), 'fingerprint_loadtest_server.log')
+        data_dir = tempfile.mkdtemp(prefix='fingerprint_loadtest_')
+        process = start_server(args.server, port, args.workers, log_path, data_dir)
+        print(f"Started {args.server} server on {base_url} (log: {log_path})", file=sys.stderr)
+
+    sampler = None
+    try:
+        wait_until_ready(base_url, process)
+        if process is not None:
+            sampler = RssSampler(process.pid, args.sample_interval)
+            sampler.start()
+
+        results = []
+        for concurrency in levels:
+            print(f"Running {args.requests} requests at concurrency {concurrency}...", file=sys.stderr)
+            result = run_level(base_url, scenario, pairs, concurrency, args.requests, args.timeout)
+            print(f"  {result['throughput_rps']} req/s, p95 {result['latency_ms'].get('p95')} ms, "
+                  f"errors {result['errors']}, rejected {result['rejected']}", file=sys.stderr)
+            results.append(result)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'config': {
+            'url': base_url,
+            'server': None if args.url else args.server,
+            'workers': args.workers,
+            'endpoint': args.endpoint,
+            'requests_per_level': args.requests,
+            'pairs': args.pairs,
+            'image_size': args.size,
+        },
+        'levels': results,
+        'saturation_concurrency': saturation_point(results),
+        'rss_samples': sampler.samples if sampler else [],
+        'rss_growth_kb': sampler.growth_per_process() if sampler else {},
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    return 1 if any(level['errors'] for level in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
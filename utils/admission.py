@@ -0,0 +1,277 @@
+import os
+import atexit
+import multiprocessing
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Indexes into the shared counters array
+ADMITTED, REJECTED_QUEUE_FULL, REJECTED_TIMEOUT, MAX_WAITING_SEEN, RECLAIMED = range(5)
+# Waiters re-check this often for a free running slot
+QUEUE_POLL_INTERVAL = 0.02
+# and at least this often for slots held by workers that died
+REAP_INTERVAL = 1.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (queue full or wait timed out)"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _start_time(pid):
+    """Start time of pid in clock ticks since boot (/proc/<pid>/stat field 22), 0 where unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name in field 2 may contain spaces; the fields after it are plain
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+_identity = (None, 0)
+
+
+def _me():
+    """(pid, start time) of this process, recomputed after fork"""
+    global _identity
+    pid = os.getpid()
+    if _identity[0] != pid:
+        _identity = (pid, _start_time(pid))
+    return _identity
+
+
+def _holder_alive(pid, start):
+    # A pid that was reused by a new process has a different start time
+    return _pid_alive(pid) and (not start or _start_time(pid) == start)
+
+
+class _FileLock:
+    """
+    Mutex across threads and processes: a thread lock plus flock on a file.
+
+    The kernel releases a flock when its holder dies, so a worker killed
+    while holding the lock (timeout kill, OOM, SIGKILL) cannot wedge the
+    others. Every process opens the file itself, since a descriptor
+    inherited through fork would share one lock between parent and child.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._pid != os.getpid():
+                self._file = open(self.path, 'a')
+                self._pid = os.getpid()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+def _remove_lock_file(path, creator):
+    # Forked workers inherit the atexit handler; only the creating process removes the file
+    if os.getpid() == creator:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a short bounded wait queue.
+
+    At most max_concurrent requests run at once, up to max_queue more wait
+    for at most queue_timeout seconds, and everything beyond that is rejected
+    immediately so the client can retry later instead of slowing down every
+    request in flight.
+
+    The limits apply across processes: the running and waiting slots live in
+    shared memory created with the controller, so every gunicorn worker
+    forked from the preloaded app shares them, and they are guarded by a
+    flock that dies with its holder. Each slot records the pid and start
+    time of the process holding it, and slots of workers that died (timeout
+    kill, crash) are reclaimed, also when the pid has been reused since.
+    Where shared memory or flock is not available (some serverless runtimes)
+    the limits fall back to the current process.
+    """
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout=5.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._last_reap = 0.0
+
+        try:
+            if fcntl is None:
+                raise OSError('flock is not available')
+            # Slot i holds (pid, start time) at [2i, 2i + 1]; pid 0 is free
+            self._running = multiprocessing.RawArray('q', 2 * self.max_concurrent)
+            self._waiting = multiprocessing.RawArray('q', 2 * self.max_queue)
+            self._counters = multiprocessing.RawArray('q', 5)
+            # Recent service time, used to suggest when to retry (negative until the first request)
+            self._avg_service = multiprocessing.RawArray('d', [-1.0])
+            fd, lock_path = tempfile.mkstemp(prefix='fingerprint_admission_', suffix='.lock')
+            os.close(fd)
+            self._lock = _FileLock(lock_path)
+            atexit.register(_remove_lock_file, lock_path, os.getpid())
+            self.shared = True
+        except OSError as e:
+            print(f"Admission control limited to this process, no shared memory: {str(e)}")
+            self._lock = threading.Lock()
+            self._running = [0] * (2 * self.max_concurrent)
+            self._waiting = [0] * (2 * self.max_queue)
+            self._counters = [0] * 5
+            self._avg_service = [-1.0]
+            self.shared = False
+
+    def _reap(self, throttle=False):
+        """Free slots held by processes that no longer exist (call with the lock held)"""
+        now = time.monotonic()
+        if throttle and now - self._last_reap < REAP_INTERVAL:
+            return
+        self._last_reap = now
+        me = os.getpid()
+        freed = 0
+        for slots in (self._running, self._waiting):
+            for i in range(0, len(slots), 2):
+                pid, start = slots[i], slots[i + 1]
+                if pid and pid != me and not _holder_alive(pid, start):
+                    slots[i] = slots[i + 1] = 0
+                    freed += 1
+        if freed:
+            self._counters[RECLAIMED] += freed
+            print(f"Admission control reclaimed {freed} slots of exited workers")
+
+    @staticmethod
+    def _take(slots):
+        for i in range(0, len(slots), 2):
+            if not slots[i]:
+                slots[i], slots[i + 1] = _me()
+                return True
+        return False
+
+    @staticmethod
+    def _give_back(slots):
+        me = os.getpid()
+        for i in range(0, len(slots), 2):
+            if slots[i] == me:
+                slots[i] = slots[i + 1] = 0
+                return
+
+    @staticmethod
+    def _count(slots):
+        return sum(1 for i in range(0, len(slots), 2) if slots[i])
+
+    def retry_after(self):
+        """Seconds a rejected client should wait, estimated from recent service times"""
+        if self._avg_service[0] < 0:
+            return max(1, int(self.queue_timeout))
+        backlog = (self._count(self._running) + self._count(self._waiting)) / self.max_concurrent
+        return max(1, int(round(self._avg_service[0] * max(backlog, 1))))
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            self._reap()
+            # Queued requests poll for a free slot; a newcomer does not overtake them
+            admitted = not self._count(self._waiting) and self._take(self._running)
+            if admitted:
+                self._counters[ADMITTED] += 1
+            else:
+                if not self._take(self._waiting):
+                    self._counters[REJECTED_QUEUE_FULL] += 1
+                    raise AdmissionRejected('queue full', self.retry_after())
+                waiting = self._count(self._waiting)
+                self._counters[MAX_WAITING_SEEN] = max(self._counters[MAX_WAITING_SEEN], waiting)
+
+        if not admitted:
+            # Poll instead of waiting on a condition: a waiter killed inside a
+            # multiprocessing.Condition leaves it unusable for everyone else
+            end = time.monotonic() + self.queue_timeout
+            try:
+                while True:
+                    time.sleep(min(QUEUE_POLL_INTERVAL, max(end - time.monotonic(), 0)))
+                    with self._lock:
+                        self._reap(throttle=True)
+                        if self._take(self._running):
+                            self._counters[ADMITTED] += 1
+                            break
+                        if time.monotonic() >= end:
+                            self._counters[REJECTED_TIMEOUT] += 1
+                            raise AdmissionRejected('queue wait timed out', self.retry_after())
+            finally:
+                with self._lock:
+                    self._give_back(self._waiting)
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._give_back(self._running)
+                if self._avg_service[0] < 0:
+                    self._avg_service[0] = elapsed
+                else:
+                    self._avg_service[0] = 0.8 * self._avg_service[0] + 0.2 * elapsed
+
+    def limit(self, view):
+        """Decorator for Flask views: run under admission control, 503 + Retry-After when rejected"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with self.admit():
+                    return view(*args, **kwargs)
+            except AdmissionRejected as e:
+                print(f"Admission rejected ({e.reason}), retry after {e.retry_after}s")
+                return "Server is busy, please retry shortly", 503, {'Retry-After': str(e.retry_after)}
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            self._reap()
+            return {
+                'scope': 'all workers' if self.shared else 'this process',
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self._count(self._running),
+                'queue_depth': self._count(self._waiting),
+                'max_queue_depth_seen': self._counters[MAX_WAITING_SEEN],
+                'admitted': self._counters[ADMITTED],
+                'rejected_queue_full': self._counters[REJECTED_QUEUE_FULL],
+                'rejected_timeout': self._counters[REJECTED_TIMEOUT],
+                'reclaimed_slots': self._counters[RECLAIMED],
+                'avg_service_seconds': round(self._avg_service[0], 3) if self._avg_service[0] >= 0 else None,
+            }
@@ -0,0 +1,81 @@
+import cv2
+import os
+import hashlib
+import mimetypes
+
+# Python 3.9 does not know the WebP mimetype on every platform
+mimetypes.add_type('image/webp', '.webp')
+
+PREVIEW_MAX_SIDE = 1600
+PREVIEW_QUALITY = 80
+FULL_RESOLUTION_SUFFIX = '_full'
+
+# Artifacts never change once written, so browsers may keep them for a year
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+
+
+def preview_format():
+    """Return the preview extension supported by this OpenCV build"""
+    if cv2.haveImageWriter('preview.webp'):
+        return '.webp'
+    return '.jpg'
+
+
+def _encode_params(ext):
+    if ext == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, PREVIEW_QUALITY]
+    if ext == '.jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY,
+                cv2.IMWRITE_JPEG_PROGRESSIVE, 1,
+                cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    return []
+
+
+def downscale(image, max_side=PREVIEW_MAX_SIDE):
+    """Downscale image so that its longest side is at most max_side"""
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if longest <= max_side:
+        return image
+    scale = max_side / longest
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def full_resolution_filename(preview_filename):
+    """Name of the lossless full-resolution file that belongs to a preview"""
+    stem = os.path.splitext(preview_filename)[0]
+    return f"{stem}{FULL_RESOLUTION_SUFFIX}.png"
+
+
+def save_artifact(image, results_folder, stem, full_resolution=False, max_side=PREVIEW_MAX_SIDE):
+    """
+    Save a result image as a size-bounded preview and return its filename.
+
+    The preview is WebP (progressive JPEG if this OpenCV build cannot write
+    WebP). With full_resolution=True a lossless PNG is written as well, see
+    full_resolution_filename().
+    """
+    ext = preview_format()
+    filename = f"{stem}{ext}"
+    path = os.path.join(results_folder, filename)
+
+    if not cv2.imwrite(path, downscale(image, max_side), _encode_params(ext)):
+        raise Exception(f"Failed to save {filename}")
+
+    if full_resolution:
+        full_path = os.path.join(results_folder, full_resolution_filename(filename))
+        if not cv2.imwrite(full_path, image, [cv2.IMWRITE_PNG_COMPRESSION, 3]):
+            raise Exception(f"Failed to save {full_resolution_filename(filename)}")
+
+    return filename
+
+
+def artifact_etag(filename):
+    """
+    Strong ETag for an immutable artifact.
+
+    Upload filenames are content hashes and result filenames are unique per
+    request, so the name alone identifies the bytes.
+    """
+    return hashlib.sha256(filename.encode('utf-8')).hexdigest()[:32]
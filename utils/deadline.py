@@ -0,0 +1,78 @@
+import time
+
+# Rough single-core costs used to project whether a stage fits the remaining
+# budget. Measured with synthetic prints; they only need to be within a
+# factor of ~2 to steer degradation decisions.
+COST_MODEL = {
+    'sift_per_mp': 0.35,             # SIFT detect + compute, seconds per megapixel
+    'match_per_query': 5e-6,         # FLANN knnMatch, seconds per query x log2(train size)
+    'visualization_per_mp': 0.2,     # drawing + preview encoding, seconds per megapixel
+    'nlmeans_per_mp': 1.0,           # fastNlMeansDenoising(h=10, 7, 21)
+    'bilateral_per_mp': 0.03,        # bilateralFilter(9, 75, 75)
+}
+
+# Never downscale below this many pixels per image
+MIN_PIXELS = 300 * 300
+# Never keep fewer keypoints than this when capping
+MIN_KEYPOINTS = 200
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of its compute budget"""
+
+    def __init__(self, stage, elapsed):
+        super().__init__(f"Compute deadline exceeded during {stage} after {elapsed:.1f}s")
+        self.stage = stage
+        self.elapsed = elapsed
+
+
+class Deadline:
+    """
+    Compute budget for one request.
+
+    Pipeline stages call check() between steps, which raises DeadlineExceeded
+    once the budget is spent, and fits() before expensive steps to decide
+    whether to run a cheaper variant. Every degradation that was applied is
+    recorded in self.degradations so it can be reported to the user.
+    """
+
+    def __init__(self, budget_seconds):
+        self.budget = budget_seconds
+        self.start = time.monotonic()
+        self.degradations = []
+        self.skipped_stages = set()
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        return self.budget - self.elapsed()
+
+    def check(self, stage):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage, self.elapsed())
+
+    def fits(self, projected_seconds, share=1.0):
+        """True if a stage projected to take projected_seconds fits in share of the remaining budget"""
+        return projected_seconds <= self.remaining() * share
+
+    def degrade(self, description, skipped_stage=None):
+        print(f"Degradation: {description}")
+        self.degradations.append(description)
+        if skipped_stage is not None:
+            self.skipped_stages.add(skipped_stage)
+
+    def skipped(self, stage):
+        return stage in self.skipped_stages
+
+
+def check(deadline, stage):
+    """deadline.check(stage) that accepts deadline=None"""
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def pixel_budget(deadline, share, cost_per_mp, images=1):
+    """Largest per-image pixel count whose projected cost fits share of the remaining budget"""
+    seconds = max(deadline.remaining() * share, 0)
+    return max(MIN_PIXELS, int(seconds / (cost_per_mp * images) * 1e6))
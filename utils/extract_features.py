@@ -1,7 +1,9 @@
 import cv2
+import struct
 import numpy as np
 from skimage.feature import peak_local_max
 from scipy.ndimage import gaussian_filter
+from utils.deadline import check
 
 def compute_orientation_field(image, block_size=16):
     """Compute the orientation field of the fingerprint"""
@@ -17,7 +19,7 @@ def compute_orientation_field(image, block_size=16):
     
     return orientation
 
-def skeletonize(image):
+def skeletonize(image, deadline=None):
     """Skeletonize binary image using morphological operations"""
     # Convert to binary
     _, binary = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
@@ -44,70 +46,143 @@ def skeletonize(image):
         # Check if done
         if cv2.countNonZero(binary) == 0:
             done = True
+        check(deadline, 'skeletonization')
     
     return skeleton
 
-def detect_minutiae(image, orientation_field):
-    """Detect minutiae points in the fingerprint"""
+# Minutiae are stored as a structured array, 6 bytes per minutia
+MINUTIA_DTYPE = np.dtype([
+    ('x', np.int16),
+    ('y', np.int16),
+    ('angle', np.uint8),   # quantized to 360/256 degree steps as in ISO 19794-2
+    ('type', np.uint8),    # MINUTIA_ENDING or MINUTIA_BIFURCATION
+])
+
+# ISO 19794-2 minutia type codes
+MINUTIA_OTHER = 0
+MINUTIA_ENDING = 1
+MINUTIA_BIFURCATION = 2
+
+def quantize_angle(radians):
+    """Quantize angles in radians to 0-255 (360/256 degree steps)"""
+    turns = np.mod(radians, 2 * np.pi) / (2 * np.pi)
+    return (np.round(turns * 256).astype(np.int64) % 256).astype(np.uint8)
+
+def dequantize_angle(quantized):
+    """Convert quantized angles back to radians"""
+    return quantized.astype(np.float32) * np.float32(2 * np.pi / 256)
+
+def detect_minutiae(image, orientation_field, deadline=None):
+    """Detect minutiae points in the fingerprint, returned as a MINUTIA_DTYPE array"""
     # Apply adaptive thresholding
     binary = cv2.adaptiveThreshold(
         image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
     )
     
     # Skeletonize the binary image
-    skeleton = skeletonize(binary)
-    
-    # Find minutiae points
-    minutiae = []
-    height, width = skeleton.shape
-    
-    for y in range(1, height-1):
-        for x in range(1, width-1):
-            if skeleton[y, x] == 255:
-                # Count neighbors
-                neighbors = skeleton[y-1:y+2, x-1:x+2]
-                neighbor_count = np.sum(neighbors) - 255
-                
-                # Detect ridge endings and bifurcations
-                if neighbor_count == 1:  # Ridge ending
-                    minutiae.append({
-                        'x': x,
-                        'y': y,
-                        'type': 'ending',
-                        'angle': orientation_field[y, x]
-                    })
-                elif neighbor_count == 3:  # Bifurcation
-                    minutiae.append({
-                        'x': x,
-                        'y': y,
-                        'type': 'bifurcation',
-                        'angle': orientation_field[y, x]
-                    })
+    skeleton = skeletonize(binary, deadline)
+    check(deadline, 'minutiae detection')
+    
+    # Count the 8-connected skeleton neighbors of every pixel
+    ridge = (skeleton == 255).astype(np.uint8)
+    kernel = np.ones((3, 3), np.float32)
+    kernel[1, 1] = 0
+    neighbor_count = cv2.filter2D(ridge, -1, kernel, borderType=cv2.BORDER_CONSTANT)
+    
+    # Ridge endings have one neighbor, bifurcations three (image border excluded)
+    candidates = np.zeros(ridge.shape, dtype=bool)
+    candidates[1:-1, 1:-1] = ridge[1:-1, 1:-1] == 1
+    endings = candidates & (neighbor_count == 1)
+    bifurcations = candidates & (neighbor_count == 3)
+    
+    ys, xs = np.nonzero(endings | bifurcations)
+    minutiae = np.empty(len(xs), dtype=MINUTIA_DTYPE)
+    minutiae['x'] = xs
+    minutiae['y'] = ys
+    minutiae['angle'] = quantize_angle(orientation_field[ys, xs])
+    minutiae['type'] = np.where(bifurcations[ys, xs], MINUTIA_BIFURCATION, MINUTIA_ENDING)
     
     return minutiae
 
-def extract_features(image):
+def extract_features(image, deadline=None):
     """Main function to extract fingerprint features"""
     # Compute orientation field
     orientation_field = compute_orientation_field(image)
     
     # Detect minutiae
-    minutiae = detect_minutiae(image, orientation_field)
+    minutiae = detect_minutiae(image, orientation_field, deadline)
     
     return minutiae
 
 def visualize_minutiae(image, minutiae):
-    """Visualize minutiae points on the image"""
+    """Visualize minutiae points (MINUTIA_DTYPE array) on the image"""
     # Create a color image for visualization
     if len(image.shape) == 2:
         vis_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
     else:
         vis_image = image.copy()
     
-    # Draw minutiae points
-    for m in minutiae:
-        x, y = int(m['x']), int(m['y'])
-        color = (0, 255, 0) if m['type'] == 'ending' else (0, 0, 255)
-        cv2.circle(vis_image, (x, y), 3, color, -1)
+    # Draw minutiae points as filled discs: endings green, bifurcations red
+    disc = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    for minutia_type, color in ((MINUTIA_ENDING, (0, 255, 0)), (MINUTIA_BIFURCATION, (0, 0, 255))):
+        selected = minutiae[minutiae['type'] == minutia_type]
+        mask = np.zeros(vis_image.shape[:2], np.uint8)
+        mask[selected['y'], selected['x']] = 255
+        mask = cv2.dilate(mask, disc)
+        vis_image[mask > 0] = color
     
-    return vis_image 
\ No newline at end of file
+    return vis_image
+
+# Binary minutiae template, modelled on ISO/IEC 19794-2: big-endian header
+# followed by 6 bytes per minutia (2-bit type + 14-bit x, 2 reserved bits +
+# 14-bit y, angle in 360/256 degree steps, quality). Unlike ISO 19794-2 the
+# minutiae count is 32 bits, as the skeleton detector can find more than 255.
+TEMPLATE_MAGIC = b'FMT\0'
+TEMPLATE_VERSION = b' 10\0'
+TEMPLATE_HEADER = struct.Struct('>4s4sIHHHHI')
+TEMPLATE_MINUTIA = np.dtype([('type_x', '>u2'), ('y', '>u2'), ('angle', 'u1'), ('quality', 'u1')])
+DEFAULT_RESOLUTION = 197  # pixels per cm (500 dpi)
+
+def minutiae_to_bytes(minutiae, image_shape, resolution=DEFAULT_RESOLUTION):
+    """Serialize a MINUTIA_DTYPE array to the binary template format"""
+    if len(minutiae) and (minutiae['x'].max() >= 1 << 14 or minutiae['y'].max() >= 1 << 14):
+        raise ValueError("Minutia coordinates must fit in 14 bits")
+    
+    records = np.zeros(len(minutiae), dtype=TEMPLATE_MINUTIA)
+    records['type_x'] = (minutiae['type'].astype(np.uint16) << 14) | minutiae['x'].astype(np.uint16)
+    records['y'] = minutiae['y'].astype(np.uint16)
+    records['angle'] = minutiae['angle']
+    
+    height, width = image_shape[:2]
+    length = TEMPLATE_HEADER.size + records.nbytes
+    header = TEMPLATE_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_VERSION, length,
+                                  width, height, resolution, resolution, len(minutiae))
+    return header + records.tobytes()
+
+def minutiae_from_bytes(data):
+    """Parse the binary template format; returns (minutiae, (height, width))"""
+    if len(data) < TEMPLATE_HEADER.size:
+        raise ValueError("Template is too short")
+    magic, version, length, width, height, _, _, count = TEMPLATE_HEADER.unpack_from(data, 0)
+    if magic != TEMPLATE_MAGIC or version != TEMPLATE_VERSION:
+        raise ValueError("Not a minutiae template")
+    if length != TEMPLATE_HEADER.size + count * TEMPLATE_MINUTIA.itemsize or len(data) < length:
+        raise ValueError("Template length does not match its minutiae count")
+    
+    records = np.frombuffer(data, dtype=TEMPLATE_MINUTIA, count=count, offset=TEMPLATE_HEADER.size)
+    minutiae = np.empty(count, dtype=MINUTIA_DTYPE)
+    minutiae['x'] = records['type_x'] & 0x3FFF
+    minutiae['y'] = records['y'] & 0x3FFF
+    minutiae['angle'] = records['angle']
+    minutiae['type'] = records['type_x'] >> 14
+    return minutiae, (height, width)
+
+def save_template(path, minutiae, image_shape, resolution=DEFAULT_RESOLUTION):
+    """Save minutiae to a binary template file"""
+    with open(path, 'wb') as f:
+        f.write(minutiae_to_bytes(minutiae, image_shape, resolution))
+
+def load_template(path):
+    """Load minutiae from a binary template file; returns (minutiae, (height, width))"""
+    with open(path, 'rb') as f:
+        return minutiae_from_bytes(f.read())
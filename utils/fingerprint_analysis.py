@@ -2,25 +2,67 @@ import cv2
 import numpy as np
 from skimage import feature, measure
 from scipy import ndimage
+from utils.deadline import check
+from utils.profiling import stage
+
+# مستويات التحليل: الأسرع يحلل نسخة مصغرة من الصورة
+# forensic هو التحليل الكامل الافتراضي
+ANALYSIS_TIERS = {
+    'fast': {'minutiae': 'downsampled', 'pattern': 'downsampled', 'ridges': 'downsampled'},
+    'balanced': {'minutiae': 'full', 'pattern': 'downsampled', 'ridges': 'downsampled'},
+    'forensic': {'minutiae': 'full', 'pattern': 'full', 'ridges': 'full'},
+}
+DEFAULT_TIER = 'forensic'
+
+# أطول ضلع للنسخة المصغرة المستخدمة في التحليل السريع
+ANALYSIS_MAX_SIDE = 512
+
+def downsample(img, max_side=ANALYSIS_MAX_SIDE):
+    """Return (image scaled so its longer side is at most max_side, scale factor)"""
+    scale = max_side / max(img.shape[:2])
+    if scale >= 1:
+        return img, 1.0
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+def analyze_fingerprint(image_path, deadline=None, tier=DEFAULT_TIER):
+    """tier: fast / balanced / forensic (see ANALYSIS_TIERS)"""
+    if tier not in ANALYSIS_TIERS:
+        raise ValueError(f"Unknown tier {tier!r}, expected one of {', '.join(ANALYSIS_TIERS)}")
+    options = ANALYSIS_TIERS[tier]
 
-def analyze_fingerprint(image_path):
     # قراءة الصورة
     img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
     
     # تحسين جودة الصورة
     img = cv2.equalizeHist(img)
+    small, scale = downsample(img)
+    images = {'full': img, 'downsampled': small}
     
     # تحليل النقاط المميزة
-    minutiae_points = detect_minutiae(img)
+    with stage('minutiae'):
+        minutiae_points = detect_minutiae(images[options['minutiae']])
+        if options['minutiae'] == 'downsampled' and scale != 1.0:
+            # إرجاع الإحداثيات إلى أبعاد الصورة الأصلية
+            minutiae_points = {kind: [(int(round(x / scale)), int(round(y / scale))) for x, y in points]
+                               for kind, points in minutiae_points.items()}
+    check(deadline, 'minutiae analysis')
     
     # تحليل نمط البصمة
-    pattern = analyze_pattern(img)
+    with stage('pattern'):
+        pattern = analyze_pattern(images[options['pattern']])
+    check(deadline, 'pattern analysis')
     
     # تحليل التلال والأخاديد
-    ridges_analysis = analyze_ridges(img)
+    with stage('ridges'):
+        ridges_analysis = analyze_ridges(images[options['ridges']])
+        if options['ridges'] == 'downsampled':
+            # عدد بكسلات الحواف يتناسب مع مساحة الصورة، فالتصحيح بمربع معامل التصغير
+            ridges_analysis["ridge_count"] /= scale ** 2
+    check(deadline, 'ridge analysis')
     
     # تجميع النتائج
     analysis_results = {
+        "tier": tier,
         "pattern_type": pattern,
         "minutiae_points": minutiae_points,
         "ridges_analysis": ridges_analysis,
@@ -0,0 +1,126 @@
+"""
+Best-frame selection for multi-frame captures.
+
+A phone burst, a clip exported as images or a multi-page TIFF usually holds
+a few sharp frames among many blurred ones. Every frame is scored on a
+small downsampled copy, and only the best frames go through full feature
+extraction and matching.
+
+Frames are referred to as (path, page) pairs, page None for a single image,
+so scoring never holds more than one frame in memory. Single images are
+decoded at a reduced size (JPEG decodes only the needed DCT coefficients);
+TIFF pages are decoded one at a time and downsampled.
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.deadline import check
+from utils.fingerprint_analysis import calculate_quality_score
+
+MULTI_PAGE_EXTENSIONS = {'.tif', '.tiff'}
+# Frames are scored on a copy whose longer side is at most this many pixels
+FRAME_SCORE_SIDE = 256
+# Number of best frames per side that are fully matched
+FRAMES_TO_MATCH = 2
+# Laplacian variance that scores 50 on the sharpness scale
+SHARPNESS_MIDPOINT = 1000.0
+COHERENCE_BLOCK = 16
+# Reduced decodes, largest reduction first
+REDUCED_DECODES = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                   (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                   (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+
+def frame_refs(path):
+    """(path, page) of every frame in an image file; page is None unless it is a page of a multi-page TIFF"""
+    if os.path.splitext(path)[1].lower() in MULTI_PAGE_EXTENSIONS:
+        try:
+            pages = cv2.imcount(path)
+        except cv2.error:
+            pages = 0
+        if pages > 1:
+            return [(path, page) for page in range(pages)]
+    return [(path, None)]
+
+
+def load_frame(path, page=None):
+    """Decode one frame at full resolution as a grayscale array, or None"""
+    if page is None:
+        return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    ok, pages = cv2.imreadmulti(path, start=page, count=1, flags=cv2.IMREAD_GRAYSCALE)
+    return pages[0] if ok and pages else None
+
+
+def _reduced_decode_flag(path):
+    """Largest reduction that keeps the longer side at least FRAME_SCORE_SIDE, from the image header"""
+    try:
+        with Image.open(path) as image:
+            longer_side = max(image.size)
+    except Exception:
+        return cv2.IMREAD_GRAYSCALE
+    for factor, flag in REDUCED_DECODES:
+        if longer_side // factor >= FRAME_SCORE_SIDE:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def load_score_copy(path, page=None):
+    """Decode one frame at scoring size (at most FRAME_SCORE_SIDE on the longer side), or None"""
+    if page is None:
+        frame = cv2.imread(path, _reduced_decode_flag(path))
+    else:
+        frame = load_frame(path, page)
+    return None if frame is None else _downsample(frame)
+
+
+def _downsample(gray):
+    scale = FRAME_SCORE_SIDE / max(gray.shape[:2])
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def ridge_coherence(gray):
+    """Mean orientation coherence of the structure tensor (0-1); blur and smudges lower it"""
+    img = gray.astype(np.float32)
+    gx = cv2.Sobel(img, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(img, cv2.CV_32F, 0, 1, ksize=3)
+    block = (COHERENCE_BLOCK, COHERENCE_BLOCK)
+    gxx = cv2.boxFilter(gx * gx, -1, block)
+    gyy = cv2.boxFilter(gy * gy, -1, block)
+    gxy = cv2.boxFilter(gx * gy, -1, block)
+    coherence = np.sqrt((gxx - gyy) ** 2 + 4 * gxy ** 2) / (gxx + gyy + 1e-6)
+    return float(coherence.mean())
+
+
+def frame_score(gray):
+    """
+    Cheap 0-100 frame score: sharpness (Laplacian variance), ridge
+    coherence and calculate_quality_score, all on a downsampled copy.
+    """
+    small = _downsample(gray)
+    laplacian_variance = cv2.Laplacian(small, cv2.CV_64F).var()
+    sharpness = 100 * laplacian_variance / (laplacian_variance + SHARPNESS_MIDPOINT)
+    coherence = 100 * ridge_coherence(small)
+    quality = calculate_quality_score(small)
+    return {
+        'score': round(float(0.5 * sharpness + 0.3 * coherence + 0.2 * quality), 2),
+        'sharpness': round(float(sharpness), 2),
+        'coherence': round(float(coherence), 2),
+        'quality': round(float(quality), 2),
+    }
+
+
+def select_frames(refs, count=FRAMES_TO_MATCH, deadline=None):
+    """Return [(index into refs, frame_score dict)] of the count best frames, best first; unreadable frames are skipped"""
+    scored = []
+    for index, (path, page) in enumerate(refs):
+        check(deadline, 'frame selection')
+        small = load_score_copy(path, page)
+        if small is not None:
+            scored.append((index, frame_score(small)))
+    scored.sort(key=lambda item: -item[1]['score'])
+    return scored[:count]
@@ -0,0 +1,322 @@
+"""
+Binary gallery of enrolled SIFT templates.
+
+Layout (little endian):
+
+    file header   32 bytes   magic b'FPGALLRY', version, descriptor dim,
+                             descriptor dtype code
+    record        RECORD_HEADER_SIZE bytes header
+                  signature   SIGNATURE_SIZE float32
+                  keypoints   n x KEYPOINT_FIELDS float32
+                  descriptors n x dim float32 or uint8
+                  zero padding up to a multiple of ALIGNMENT
+    record        ...
+
+Records are only ever appended; enrolling an identity again appends a new
+record that supersedes the old one. Readers map the whole file with
+numpy.memmap, so every worker process shares the same pages through the OS
+page cache and templates are returned as zero-copy views.
+
+Every record carries the orientation signature from utils.signature, used
+to prefilter 1:N searches. Files of the earlier, signature-less layout
+(version 1) are rejected; enroll the prints again.
+"""
+
+import os
+import struct
+import threading
+import cv2
+import numpy as np
+from collections import namedtuple
+from utils.signature import SIGNATURE_SIZE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+MAGIC = b'FPGALLRY'
+VERSION = 2
+FILE_HEADER = struct.Struct('<8sHHB19x')
+RECORD_MAGIC = b'FPRC'
+# magic, keypoint count, image width, image height, identity (utf-8, null padded)
+RECORD_HEADER = struct.Struct('<4sIII64s16x')
+RECORD_HEADER_SIZE = RECORD_HEADER.size
+SIGNATURE_BYTES = SIGNATURE_SIZE * 4
+ALIGNMENT = 16
+MAX_IDENTITY_BYTES = 64
+
+KEYPOINT_FIELDS = ('x', 'y', 'size', 'angle', 'response')
+DESCRIPTOR_DTYPES = {0: np.float32, 1: np.uint8}
+DESCRIPTOR_CODES = {np.dtype(v): k for k, v in DESCRIPTOR_DTYPES.items()}
+SIFT_DIMENSIONS = 128
+
+
+class GalleryFormatError(Exception):
+    pass
+
+
+# Per-file record layout, derived from the file header
+Layout = namedtuple('Layout', 'dimensions dtype')
+
+
+def _padded(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def keypoints_to_array(keypoints):
+    """Convert cv2.KeyPoint objects to an n x KEYPOINT_FIELDS float32 array"""
+    array = np.empty((len(keypoints), len(KEYPOINT_FIELDS)), dtype=np.float32)
+    for i, kp in enumerate(keypoints):
+        array[i] = (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response)
+    return array
+
+
+def array_to_keypoints(array):
+    """Convert a keypoint array back to cv2.KeyPoint objects (for drawing)"""
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response))
+            for x, y, size, angle, response in array]
+
+
+def create_gallery(path, descriptor_dtype=np.float32, dimensions=SIFT_DIMENSIONS):
+    """Create an empty gallery file"""
+    code = DESCRIPTOR_CODES.get(np.dtype(descriptor_dtype))
+    if code is None:
+        raise ValueError(f"Unsupported descriptor dtype: {descriptor_dtype}")
+    with open(path, 'xb') as f:
+        f.write(FILE_HEADER.pack(MAGIC, VERSION, dimensions, code))
+
+
+def _read_file_header(data):
+    if len(data) < FILE_HEADER.size:
+        raise GalleryFormatError("File is too small to be a gallery")
+    magic, version, dimensions, code = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise GalleryFormatError("Not a fingerprint gallery file")
+    if version != VERSION:
+        raise GalleryFormatError(f"Unsupported gallery version {version} (expected {VERSION}); enroll the prints again")
+    if code not in DESCRIPTOR_DTYPES:
+        raise GalleryFormatError(f"Unknown descriptor dtype code {code}")
+    return Layout(dimensions, np.dtype(DESCRIPTOR_DTYPES[code]))
+
+
+def _record_size(count, layout):
+    keypoint_bytes = count * len(KEYPOINT_FIELDS) * 4
+    descriptor_bytes = count * layout.dimensions * layout.dtype.itemsize
+    return _padded(RECORD_HEADER_SIZE + SIGNATURE_BYTES + keypoint_bytes + descriptor_bytes)
+
+
+def _scan_records(data, offset, layout):
+    """Yield (identity, offset, count, width, height, size) for complete records"""
+    end = len(data)
+    while offset + RECORD_HEADER_SIZE <= end:
+        magic, count, width, height, raw_id = RECORD_HEADER.unpack_from(data, offset)
+        if magic != RECORD_MAGIC:
+            raise GalleryFormatError(f"Corrupt record header at offset {offset}")
+        size = _record_size(count, layout)
+        if offset + size > end:
+            # Record is still being written (or was truncated by a crash)
+            break
+        identity = raw_id.rstrip(b'\0').decode('utf-8')
+        yield identity, offset, count, width, height, size
+        offset += size
+
+
+def append_template(path, identity, keypoints, descriptors, image_shape=(0, 0), signature=None):
+    """
+    Append one enrolled template to the gallery at path.
+
+    keypoints may be cv2.KeyPoint objects or an array from keypoints_to_array.
+    signature is the orientation descriptor from
+    utils.signature.orientation_descriptor; without one the record is stored
+    with a zero signature, which has no similarity to any probe.
+    Only the new record is written; existing records are never rewritten.
+    """
+    raw_id = identity.encode('utf-8')
+    if not raw_id or len(raw_id) > MAX_IDENTITY_BYTES:
+        raise ValueError(f"Identity must be 1-{MAX_IDENTITY_BYTES} bytes of UTF-8")
+
+    if not isinstance(keypoints, np.ndarray):
+        keypoints = keypoints_to_array(keypoints)
+    keypoints = np.ascontiguousarray(keypoints, dtype=np.float32)
+    count = len(keypoints)
+
+    with open(path, 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            layout = _read_file_header(f.read(FILE_HEADER.size))
+            dimensions, dtype = layout.dimensions, layout.dtype
+
+            if descriptors is None:
+                descriptors = np.empty((0, dimensions), dtype=dtype)
+            if descriptors.shape != (count, dimensions):
+                raise ValueError(f"Expected descriptors of shape {(count, dimensions)}, got {descriptors.shape}")
+            if dtype == np.uint8:
+                descriptors = np.clip(np.rint(descriptors), 0, 255)
+            descriptors = np.ascontiguousarray(descriptors, dtype=dtype)
+
+            # Drop a partially written trailing record left by a crashed writer
+            file_size = os.fstat(f.fileno()).st_size
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+            end = FILE_HEADER.size
+            for _, offset, _, _, _, size in _scan_records(data, FILE_HEADER.size, layout):
+                end = offset + size
+            del data
+            if end != file_size:
+                f.truncate(end)
+
+            orientation = np.zeros(SIGNATURE_SIZE, dtype=np.float32)
+            if signature is not None:
+                orientation = np.ascontiguousarray(signature, dtype=np.float32)
+                if orientation.shape != (SIGNATURE_SIZE,):
+                    raise ValueError(f"Expected a signature of {SIGNATURE_SIZE} values, got {orientation.shape}")
+
+            height, width = image_shape[:2]
+            header = RECORD_HEADER.pack(RECORD_MAGIC, count, width, height, raw_id)
+            body = header + orientation.tobytes() + keypoints.tobytes() + descriptors.tobytes()
+            body += b'\0' * (_record_size(count, layout) - len(body))
+
+            f.seek(end)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Gallery:
+    """
+    Read-only, memory-mapped view of a gallery file.
+
+    get() returns views into the mapping, so no descriptor data is copied
+    into process memory. Call refresh() to pick up records appended by an
+    enrollment run after the gallery was opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self._end = FILE_HEADER.size
+        self._index = {}
+        self._order = []
+        self._signatures = None
+        with open(path, 'rb') as f:
+            self.layout = _read_file_header(f.read(FILE_HEADER.size))
+        self.dimensions = self.layout.dimensions
+        self.descriptor_dtype = self.layout.dtype
+        self.refresh()
+
+    def refresh(self):
+        """Map newly appended records; returns the number of records added"""
+        with self._lock:
+            size = os.path.getsize(self.path)
+            if self._data is not None and size == len(self._data):
+                return 0
+            data = np.memmap(self.path, dtype=np.uint8, mode='r')
+            added = 0
+            for identity, offset, count, width, height, record_size in _scan_records(
+                    data, self._end, self.layout):
+                if identity not in self._index:
+                    self._order.append(identity)
+                self._index[identity] = (offset, count, width, height)
+                self._end = offset + record_size
+                added += 1
+            self._data = data
+            if added:
+                self._signatures = None
+            return added
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, identity):
+        return identity in self._index
+
+    def identities(self):
+        return list(self._order)
+
+    def image_shape(self, identity):
+        _, _, width, height = self._index[identity]
+        return height, width
+
+    def keypoint_count(self, identity):
+        return self._index[identity][1]
+
+    def record_offset(self, identity):
+        """File offset of identity's current record; changes when the identity is enrolled again"""
+        return self._index[identity][0]
+
+    def signature(self, identity):
+        """Return the orientation descriptor of identity as a zero-copy view"""
+        start = self._index[identity][0] + RECORD_HEADER_SIZE
+        return self._data[start:start + SIGNATURE_BYTES].view(np.float32)
+
+    def signatures(self):
+        """
+        Return (identities, orientation matrix) for the whole gallery, one row
+        per identity in enrollment order. Built once per refresh so searches
+        can score every signature with one matrix product.
+        """
+        with self._lock:
+            if self._signatures is None:
+                identities = list(self._order)
+                matrix = np.zeros((len(identities), SIGNATURE_SIZE), dtype=np.float32)
+                for row, identity in enumerate(identities):
+                    matrix[row] = self.signature(identity)
+                self._signatures = (identities, matrix)
+            return self._signatures
+
+    def get(self, identity):
+        """Return (keypoints, descriptors) arrays for identity as zero-copy views"""
+        offset, count, _, _ = self._index[identity]
+        data = self._data
+        start = offset + RECORD_HEADER_SIZE + SIGNATURE_BYTES
+        keypoint_bytes = count * len(KEYPOINT_FIELDS) * 4
+        keypoints = data[start:start + keypoint_bytes].view(np.float32).reshape(count, len(KEYPOINT_FIELDS))
+        start += keypoint_bytes
+        descriptor_bytes = count * self.dimensions * self.descriptor_dtype.itemsize
+        descriptors = data[start:start + descriptor_bytes].view(self.descriptor_dtype).reshape(count, self.dimensions)
+        return keypoints, descriptors
+
+    def get_float32(self, identity):
+        """Like get(), but descriptors as float32 as required by the FLANN matcher"""
+        keypoints, descriptors = self.get(identity)
+        if descriptors.dtype != np.float32:
+            descriptors = descriptors.astype(np.float32)
+        return keypoints, descriptors
+
+    def __iter__(self):
+        for identity in self._order:
+            yield identity, self.get(identity)
+
+
+def open_gallery(path):
+    """Open the gallery at path, or return None if it does not exist"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        gallery = Gallery(path)
+        print(f"Loaded gallery {path} with {len(gallery)} identities")
+        return gallery
+    except Exception as e:
+        print(f"Error loading gallery {path}: {str(e)}")
+        return None
+
+
+def enroll_image(path, identity, image_path):
+    """Extract SIFT features and the search signature from image_path and append them to the gallery"""
+    from utils.match_fingerprint import extract_sift_features
+    from utils.signature import orientation_descriptor
+
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not read image from {image_path}")
+    keypoints, descriptors = extract_sift_features(image)
+    if descriptors is None:
+        keypoints, descriptors = [], None
+    append_template(path, identity, keypoints, descriptors, image.shape, orientation_descriptor(image))
+    return len(keypoints)
@@ -7,6 +7,9 @@ from typing import Dict, Any, Union
 from PIL import Image
 from datetime import datetime
 import uuid
+from utils.artifacts import save_artifact
+from utils.deadline import COST_MODEL, MIN_KEYPOINTS, DeadlineExceeded, check, pixel_budget
+from utils.profiling import stage
 
 class FingerprintMatcher:
     def __init__(self):
@@ -307,75 +310,171 @@ def get_matching_result(score):
     else:
         return "لا يوجد تطابق", "danger"
 
-def match_fingerprint(img1_path, img2_path, results_folder):
-    """Match two fingerprint images using OpenCV"""
+FLANN_INDEX_KDTREE = 1
+RATIO_TEST = 0.7
+# Score cut-offs for "Match Found!" and "Possible Match" in the web app
+MATCH_THRESHOLD = 80
+POSSIBLE_MATCH_THRESHOLD = 50
+
+def extract_sift_features(gray):
+    """Detect SIFT keypoints and descriptors on a grayscale image"""
+    sift = cv2.SIFT_create()
+    return sift.detectAndCompute(gray, None)
+
+def create_flann_matcher():
+    """FLANN KD-tree matcher used for SIFT descriptors"""
+    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+    search_params = dict(checks=50)
+    return cv2.FlannBasedMatcher(index_params, search_params)
+
+def ratio_test(matches, ratio=RATIO_TEST):
+    """Keep kNN matches that pass Lowe's ratio test"""
+    good_matches = []
+    for pair in matches:
+        if len(pair) == 2 and pair[0].distance < ratio * pair[1].distance:
+            good_matches.append(pair[0])
+    return good_matches
+
+def match_descriptors(des1, des2):
+    """Match des1 against des2 and return the matches that pass the ratio test"""
+    flann = create_flann_matcher()
+    matches = flann.knnMatch(des1, des2, k=2)
+    return ratio_test(matches)
+
+def calculate_match_score(good_matches_count, kp1_count, kp2_count):
+    """Match score in percent: good matches relative to the larger keypoint set"""
+    if max(kp1_count, kp2_count) == 0:
+        return 0
+    return (good_matches_count / max(kp1_count, kp2_count)) * 100
+
+def downscale_to(image, max_pixels):
+    """Downscale image to at most max_pixels pixels, keeping the aspect ratio"""
+    height, width = image.shape[:2]
+    if height * width <= max_pixels:
+        return image
+    scale = np.sqrt(max_pixels / (height * width))
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+def _strongest_keypoints(keypoints, descriptors, limit):
+    """Keep the limit keypoints with the highest response"""
+    order = np.argsort([-kp.response for kp in keypoints], kind='stable')[:limit]
+    return [keypoints[i] for i in order], descriptors[order]
+
+def _fit_images_to_deadline(img1, img2, deadline):
+    """Downscale both images if SIFT on them would not fit half of the remaining budget"""
+    pixels = img1.shape[0] * img1.shape[1] + img2.shape[0] * img2.shape[1]
+    projected = COST_MODEL['sift_per_mp'] * pixels / 1e6
+    if deadline.fits(projected, share=0.5):
+        return img1, img2
+    max_pixels = pixel_budget(deadline, 0.5, COST_MODEL['sift_per_mp'], images=2)
+    img1 = downscale_to(img1, max_pixels)
+    img2 = downscale_to(img2, max_pixels)
+    deadline.degrade(f"Downscaled images to {img1.shape[1]}x{img1.shape[0]} and {img2.shape[1]}x{img2.shape[0]}")
+    return img1, img2
+
+def _fit_keypoints_to_deadline(kp1, des1, kp2, des2, deadline):
+    """Cap keypoints to the strongest ones if matching would not fit half of the remaining budget"""
+    per_query = COST_MODEL['match_per_query'] * np.log2(len(kp2) + 1)
+    if deadline.fits(per_query * len(kp1), share=0.5):
+        return kp1, des1, kp2, des2
+    limit = max(MIN_KEYPOINTS, int(deadline.remaining() * 0.5 / per_query))
+    if limit >= max(len(kp1), len(kp2)):
+        return kp1, des1, kp2, des2
+    kp1, des1 = _strongest_keypoints(kp1, des1, limit)
+    kp2, des2 = _strongest_keypoints(kp2, des2, limit)
+    # The strongest keypoints match more often than the rest, so the score over
+    # them is not comparable to MATCH_THRESHOLD; callers report the verdict as
+    # inconclusive when deadline.skipped('all_keypoints')
+    deadline.degrade(f"Capped keypoints at the {limit} strongest per image (the verdict is inconclusive)",
+                     skipped_stage='all_keypoints')
+    return kp1, des1, kp2, des2
+
+def match_fingerprint(img1_path, img2_path, results_folder, full_resolution=False, deadline=None):
+    """
+    Match two fingerprint images using OpenCV
+
+    Visualizations are saved as size-bounded previews; full_resolution=True
+    additionally writes lossless full-size copies.
+
+    With a Deadline, the images are downscaled, keypoints are capped or the
+    visualizations are skipped (filenames are None) when a stage would not
+    fit the remaining budget; the applied degradations are recorded on the
+    deadline. The score and keypoint counts are those of the keypoints
+    actually matched. DeadlineExceeded is raised once the budget is spent.
+
+    Raises ValueError when an image cannot be read or has no features, so a
+    failed match is never mistaken for a score of 0.
+    """
     try:
         # Read images
-        img1 = cv2.imread(img1_path)
-        img2 = cv2.imread(img2_path)
+        with stage('read'):
+            img1 = cv2.imread(img1_path)
+            img2 = cv2.imread(img2_path)
         
         if img1 is None or img2 is None:
             raise ValueError("Could not read one or both images")
         
+        if deadline is not None:
+            img1, img2 = _fit_images_to_deadline(img1, img2, deadline)
+        
         # Convert to grayscale
         gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
         gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
         
-        # Initialize SIFT detector
-        sift = cv2.SIFT_create()
-        
         # Find keypoints and descriptors
-        kp1, des1 = sift.detectAndCompute(gray1, None)
-        kp2, des2 = sift.detectAndCompute(gray2, None)
+        with stage('sift'):
+            kp1, des1 = extract_sift_features(gray1)
+            check(deadline, 'feature extraction')
+            kp2, des2 = extract_sift_features(gray2)
+            check(deadline, 'feature extraction')
         
         if des1 is None or des2 is None:
-            return 0.0, 0, 0, 0, None, None, None, 0
+            raise ValueError("No features found in one or both images")
         
-        # FLANN matcher
-        FLANN_INDEX_KDTREE = 1
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-        search_params = dict(checks=50)
-        flann = cv2.FlannBasedMatcher(index_params, search_params)
+        if deadline is not None:
+            kp1, des1, kp2, des2 = _fit_keypoints_to_deadline(kp1, des1, kp2, des2, deadline)
+        kp1_count, kp2_count = len(kp1), len(kp2)
         
-        # Find matches
-        matches = flann.knnMatch(des1, des2, k=2)
-        
-        # Apply ratio test
-        good_matches = []
-        for m, n in matches:
-            if m.distance < 0.7 * n.distance:
-                good_matches.append(m)
+        # FLANN matching with ratio test
+        with stage('match'):
+            good_matches = match_descriptors(des1, des2)
+        check(deadline, 'matching')
         
         # Calculate match score
-        score = (len(good_matches) / max(len(kp1), len(kp2))) * 100 if max(len(kp1), len(kp2)) > 0 else 0
+        score = calculate_match_score(len(good_matches), kp1_count, kp2_count)
+        
+        if deadline is not None:
+            # drawMatches draws both images again side by side
+            pixels = 2 * (img1.shape[0] * img1.shape[1] + img2.shape[0] * img2.shape[1])
+            if not deadline.fits(COST_MODEL['visualization_per_mp'] * pixels / 1e6, share=0.8):
+                deadline.degrade("Skipped result visualizations", skipped_stage='visualization')
+                return score, kp1_count, kp2_count, len(good_matches), None, None, None, 0
         
         # Create visualizations
-        minutiae1 = visualize_minutiae(img1, kp1)
-        minutiae2 = visualize_minutiae(img2, kp2)
-        match_img = cv2.drawMatches(img1, kp1, img2, kp2, good_matches, None, 
-                                  flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
+        with stage('visualize'):
+            minutiae1 = visualize_minutiae(img1, kp1)
+            minutiae2 = visualize_minutiae(img2, kp2)
+            match_img = cv2.drawMatches(img1, kp1, img2, kp2, good_matches, None, 
+                                      flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
+        check(deadline, 'visualization')
         
         # Generate filenames
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         unique_id = str(uuid.uuid4())[:8]
         
-        minutiae1_filename = f"minutiae1_{timestamp}_{unique_id}.jpg"
-        minutiae2_filename = f"minutiae2_{timestamp}_{unique_id}.jpg"
-        match_filename = f"match_{timestamp}_{unique_id}.jpg"
-        
         # Ensure results directory exists
         os.makedirs(results_folder, exist_ok=True)
         
-        # Save images with full paths
+        # Save size-bounded previews
+        with stage('save'):
+            minutiae1_filename = save_artifact(minutiae1, results_folder, f"minutiae1_{timestamp}_{unique_id}", full_resolution)
+            minutiae2_filename = save_artifact(minutiae2, results_folder, f"minutiae2_{timestamp}_{unique_id}", full_resolution)
+            match_filename = save_artifact(match_img, results_folder, f"match_{timestamp}_{unique_id}", full_resolution)
+        
         minutiae1_path = os.path.join(results_folder, minutiae1_filename)
         minutiae2_path = os.path.join(results_folder, minutiae2_filename)
         match_path = os.path.join(results_folder, match_filename)
         
-        # Save images and verify
-        cv2.imwrite(minutiae1_path, minutiae1)
-        cv2.imwrite(minutiae2_path, minutiae2)
-        cv2.imwrite(match_path, match_img)
-        
         # Verify files were created
         if not all(os.path.exists(p) for p in [minutiae1_path, minutiae2_path, match_path]):
             raise Exception("Failed to save one or more visualization images")
@@ -383,11 +482,13 @@ def match_fingerprint(img1_path, img2_path, results_folder):
         print(f"Saved images to: {results_folder}")
         print(f"Files: {minutiae1_filename}, {minutiae2_filename}, {match_filename}")
         
-        return score, len(kp1), len(kp2), len(good_matches), match_filename, minutiae1_filename, minutiae2_filename, 0
+        return score, kp1_count, kp2_count, len(good_matches), match_filename, minutiae1_filename, minutiae2_filename, 0
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error in match_fingerprint: {str(e)}")
-        return 0.0, 0, 0, 0, None, None, None, 0
+        raise
 
 def visualize_minutiae(image, keypoints):
     """Visualize minutiae points on the image"""
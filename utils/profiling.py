@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+
+_current = ContextVar('fingerprint_profiler', default=None)
+_NOT_PROFILING = nullcontext()
+
+DEFAULT_INTERVAL = 0.005
+
+
+def stage(name):
+    """
+    Time a pipeline stage when the current request is being profiled.
+
+    Without an active profiler this returns a shared no-op context manager,
+    so instrumented code costs one ContextVar lookup per stage.
+    """
+    profiler = _current.get()
+    if profiler is None:
+        return _NOT_PROFILING
+    return profiler.stage(name)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    executor.submit() that carries the current request's profiler into the
+    worker thread: stage() timings recorded there are kept and the thread is
+    sampled while it runs fn.
+    """
+    profiler = _current.get()
+    if profiler is None:
+        return executor.submit(fn, *args, **kwargs)
+    return executor.submit(copy_context().run, profiler.traced, fn, *args, **kwargs)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for a single request.
+
+    A background thread samples the stack of the request thread, and of any
+    pool thread running work submitted with submit(), every interval seconds
+    and aggregates the samples as collapsed stacks ("a;b;c count"), the input
+    format of flamegraph.pl and speedscope. Pool thread stacks are prefixed
+    with the thread name. stage() records wall-clock timings of named
+    pipeline stages.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stages = []
+        self._local = threading.local()
+        # thread id -> stack prefix of every thread being sampled
+        self._threads = {}
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._start = None
+        self.total_seconds = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, prefix in list(self._threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if prefix:
+                    labels.append(prefix)
+                key = ';'.join(reversed(labels))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def start(self):
+        self._threads = {threading.get_ident(): None}
+        self._start = time.perf_counter()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        self.total_seconds = time.perf_counter() - self._start
+
+    def traced(self, fn, *args, **kwargs):
+        """Run fn in the current (pool) thread and sample it meanwhile"""
+        thread_id = threading.get_ident()
+        self._threads[thread_id] = threading.current_thread().name
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._threads.pop(thread_id, None)
+
+    @contextmanager
+    def stage(self, name):
+        # Stage nesting is tracked per thread, pool threads record their own stages
+        stage_path = self._local.__dict__.setdefault('stage_path', [])
+        stage_path.append(name)
+        path = '/'.join(stage_path)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing = {'stage': path, 'seconds': round(time.perf_counter() - start, 4)}
+            if self._threads.get(threading.get_ident()):
+                timing['thread'] = threading.current_thread().name
+            self.stages.append(timing)
+            stage_path.pop()
+
+    def save(self, folder, stem):
+        """Write <stem>.folded (flame graph input) and <stem>.json (stage timings); return both filenames"""
+        folded_filename = f"{stem}.folded"
+        with open(os.path.join(folder, folded_filename), 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        timings_filename = f"{stem}.json"
+        with open(os.path.join(folder, timings_filename), 'w') as f:
+            json.dump({
+                'total_seconds': round(self.total_seconds or 0, 4),
+                'sampling_interval': self.interval,
+                'samples': self.samples,
+                'stages': self.stages,
+            }, f, indent=2)
+
+        return folded_filename, timings_filename
+
+
+@contextmanager
+def profiled(enabled, interval=DEFAULT_INTERVAL):
+    """Profile the enclosed block if enabled; yields the profiler or None"""
+    if not enabled:
+        yield None
+        return
+    profiler = RequestProfiler(interval)
+    token = _current.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _current.reset(token)
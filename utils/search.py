@@ -0,0 +1,211 @@
+"""
+Ranked 1:N search over an enrolled gallery.
+
+Candidates go through a cascade of increasingly expensive stages so the
+full SIFT + ratio test comparison only runs against a short list:
+
+    signature   most similar orientation field
+                (one matrix product over the whole gallery)
+    vote        the probe's strongest descriptors vote against each survivor
+                with a brute-force kNN match
+    full match  match_fingerprint-style scoring in descending vote order,
+                kept in a bounded heap of the k best candidates
+
+The full match stage stops early only when no later candidate can beat the
+weakest of the k results so far. Every good match pairs one probe
+descriptor, so a candidate with more keypoints than the probe scores at
+most probe keypoints / candidate keypoints x 100; once the k-th score
+reaches that bound for every remaining candidate, the ranking is the exact
+top k of the shortlist.
+"""
+import time
+import heapq
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from utils.deadline import check
+from utils.match_fingerprint import MATCH_THRESHOLD, extract_sift_features, match_descriptors, calculate_match_score, ratio_test
+from utils.profiling import stage
+from utils.signature import orientation_descriptor
+
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+DEFAULT_THRESHOLD = MATCH_THRESHOLD
+
+# Signature stage: keep this fraction of the candidates, but never fewer than SIGNATURE_MIN_KEEP
+SIGNATURE_KEEP_FRACTION = 0.25
+SIGNATURE_MIN_KEEP = 32
+# Vote stage: number of probe descriptors that vote, and survivors kept (max(k * factor, min))
+VOTE_DESCRIPTORS = 64
+VOTE_KEEP_FACTOR = 4
+VOTE_MIN_KEEP = 16
+
+Probe = namedtuple('Probe', 'keypoint_count descriptors vote_descriptors orientation')
+
+
+def extract_probe(gray):
+    """Extract everything the cascade needs from a grayscale probe image, once"""
+    keypoints, descriptors = extract_sift_features(gray)
+    if descriptors is None:
+        keypoints, descriptors = [], np.empty((0, 128), dtype=np.float32)
+
+    strongest = np.argsort([-kp.response for kp in keypoints])[:VOTE_DESCRIPTORS]
+    vote_descriptors = np.ascontiguousarray(descriptors[strongest])
+
+    return Probe(len(keypoints), descriptors, vote_descriptors, orientation_descriptor(gray))
+
+
+def _stage_report(name, candidates, survivors, seconds):
+    return {
+        'stage': name,
+        'candidates': candidates,
+        'survivors': survivors,
+        'pruned_ratio': round(1 - survivors / candidates, 4) if candidates else 0.0,
+        'seconds': round(seconds, 4),
+    }
+
+
+def _signature_stage(probe, identities, matrix):
+    """Keep the candidates with the most similar orientation fields"""
+    keep = max(SIGNATURE_MIN_KEEP, int(np.ceil(len(identities) * SIGNATURE_KEEP_FRACTION)))
+    if len(identities) <= keep:
+        return list(identities)
+    similarity = matrix @ probe.orientation
+    return [identities[row] for row in np.argsort(-similarity, kind='stable')[:keep]]
+
+
+def _vote_stage(gallery, probe, candidates, keep, deadline):
+    """Rank candidates by how many of the probe's strongest descriptors pass the ratio test against them"""
+    if len(candidates) <= keep or len(probe.vote_descriptors) == 0:
+        return candidates
+
+    matcher = cv2.BFMatcher(cv2.NORM_L2)
+    votes = []
+    for identity in candidates:
+        check(deadline, 'gallery search')
+        _, descriptors = gallery.get_float32(identity)
+        count = 0
+        if len(descriptors) >= 2:
+            count = len(ratio_test(matcher.knnMatch(probe.vote_descriptors, descriptors, k=2)))
+        votes.append(count)
+
+    order = np.argsort(-np.array(votes), kind='stable')[:keep]
+    return [candidates[i] for i in order]
+
+
+def shortlist(gallery, probe, k=DEFAULT_TOP_K, deadline=None, signatures=None):
+    """
+    Run the signature and vote stages for probe.
+
+    signatures is an (identities, signature matrix) pair to search instead
+    of gallery.signatures(), e.g. a shard's slice of it. Returns (signature
+    survivors, vote survivors, stage reports); the vote survivors are the
+    candidates of the full match stage, in vote order.
+    """
+    k = min(max(1, k), MAX_TOP_K)
+    identities, matrix = signatures if signatures is not None else gallery.signatures()
+    stages = []
+
+    with stage('signature'):
+        start = time.perf_counter()
+        signature_survivors = _signature_stage(probe, identities, matrix)
+        stages.append(_stage_report('signature', len(identities), len(signature_survivors),
+                                    time.perf_counter() - start))
+    check(deadline, 'gallery search')
+
+    with stage('vote'):
+        start = time.perf_counter()
+        vote_survivors = _vote_stage(gallery, probe, signature_survivors,
+                                     max(k * VOTE_KEEP_FACTOR, VOTE_MIN_KEEP), deadline)
+        stages.append(_stage_report('vote', len(signature_survivors), len(vote_survivors),
+                                    time.perf_counter() - start))
+
+    return signature_survivors, vote_survivors, stages
+
+
+def _score_bound(probe_keypoints, candidate_keypoints):
+    """Highest score candidate_keypoints can reach against the probe (each good match uses one probe descriptor)"""
+    return calculate_match_score(min(probe_keypoints, candidate_keypoints), probe_keypoints, candidate_keypoints)
+
+
+def search_gallery(gallery, probe, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD, deadline=None, signatures=None):
+    """
+    Return the k best gallery matches for probe (from extract_probe).
+
+    Candidates scoring at or above threshold are flagged as matches.
+    signatures restricts the search to a subset of the gallery, as in
+    shortlist(). With a Deadline, the full match stage stops when the budget
+    runs out and the partial ranking is returned with a recorded degradation.
+    """
+    k = min(max(1, k), MAX_TOP_K)
+    gallery_size = len(gallery) if signatures is None else len(signatures[0])
+    _, candidates, stages = shortlist(gallery, probe, k, deadline, signatures)
+
+    # remaining_bound[i]: best score any of candidates[i:] can reach
+    bounds = [_score_bound(probe.keypoint_count, gallery.keypoint_count(identity)) for identity in candidates]
+    remaining_bound = np.maximum.accumulate(np.array(bounds[::-1] or [0.0]))[::-1]
+
+    heap = []
+    scored = 0
+    early_terminated = False
+    with stage('full_match'):
+        start = time.perf_counter()
+        for identity in candidates:
+            if deadline is not None and deadline.remaining() <= 0:
+                deadline.degrade(f"Search stopped after fully scoring {scored} of {len(candidates)} candidates")
+                break
+
+            keypoints, descriptors = gallery.get_float32(identity)
+            good_matches_count = 0
+            if len(probe.descriptors) and len(descriptors) >= 2:
+                good_matches_count = len(match_descriptors(probe.descriptors, descriptors))
+            score = calculate_match_score(good_matches_count, probe.keypoint_count, len(keypoints))
+            scored += 1
+
+            entry = (score, scored, identity, good_matches_count, len(keypoints))
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+            if len(heap) == k and scored < len(candidates) and heap[0][0] >= remaining_bound[scored]:
+                early_terminated = True
+                break
+        stages.append(_stage_report('full_match', len(candidates), scored, time.perf_counter() - start))
+
+    ranked = sorted(heap, key=lambda entry: (-entry[0], entry[1]))
+    return {
+        'candidates': [{
+            'identity': identity,
+            'score': round(score, 2),
+            'match': score >= threshold,
+            'good_matches': good_matches_count,
+            'keypoints': keypoint_count,
+        } for score, _, identity, good_matches_count, keypoint_count in ranked],
+        'k': k,
+        'threshold': threshold,
+        'gallery_size': gallery_size,
+        'full_matches': scored,
+        'early_terminated': early_terminated,
+        'stages': stages,
+    }
+
+
+def read_probe(image_path, deadline=None):
+    """Read a probe image and extract its features"""
+    with stage('read'):
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Could not read image from {image_path}")
+
+    with stage('probe'):
+        probe = extract_probe(gray)
+    check(deadline, 'feature extraction')
+    return probe
+
+
+def search_image(gallery, image_path, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD, deadline=None):
+    """Read a probe image, extract its features and search the gallery"""
+    return search_gallery(gallery, read_probe(image_path, deadline), k, threshold, deadline)
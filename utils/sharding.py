@@ -0,0 +1,420 @@
+"""
+Sharded 1:N gallery search across local worker processes.
+
+Enrolled identities are partitioned between shards with a consistent hash
+ring. Every shard runs in its own process, stands in for a search node, and
+searches only the identities it owns. Here all shards map the same gallery
+file, so each one only touches its own records' pages.
+
+The coordinator extracts the probe once, scatters it to all shards in
+parallel, and merges the per-shard top-k lists. Each shard gets a compute
+budget a little shorter than the coordinator's timeout, so a shard that
+runs out of time still returns its partial ranking. A shard that does not
+answer within the timeout is reported and left out of the merge instead of
+failing the whole search. It is reported busy until its late reply arrives,
+and only restarted when it overruns its own budget as well. A shard whose
+process died is restarted on the next call, and a restarted shard is
+reported as starting until it has opened the gallery. health() never waits
+behind a running search.
+"""
+import bisect
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.deadline import Deadline
+from utils.gallery import Gallery
+from utils.search import DEFAULT_TOP_K, DEFAULT_THRESHOLD, MAX_TOP_K, search_gallery
+
+VIRTUAL_NODES = 64
+DEFAULT_SHARD_TIMEOUT = 10.0
+PING_TIMEOUT = 2.0
+# Time left for a shard's reply to reach the coordinator, at most a quarter of the timeout
+REPLY_MARGIN = 0.5
+# A shard still busy this long after its budget ran out is considered hung
+HUNG_GRACE = 2.0
+STARTUP_TIMEOUT = 60.0
+# Request id of the message a shard sends once it is ready for requests
+READY = -1
+
+
+def _hash(key):
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping identities to shard ids"""
+
+    def __init__(self, shard_ids, virtual_nodes=VIRTUAL_NODES):
+        self.shard_ids = sorted(shard_ids)
+        points = sorted((_hash(f"shard-{shard}#{v}"), shard)
+                        for shard in self.shard_ids for v in range(virtual_nodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def owner(self, identity):
+        index = bisect.bisect(self._keys, _hash(identity)) % len(self._keys)
+        return self._owners[index]
+
+
+class ShardUnavailable(Exception):
+    """A shard did not answer in time, failed, or its process is gone"""
+
+    def __init__(self, shard_id, status, message):
+        super().__init__(f"Shard {shard_id} {status}: {message}")
+        self.shard_id = shard_id
+        self.status = status
+
+
+def _owned_signatures(gallery, ring, shard_id, owned_rows, scanned):
+    """
+    Return ((identities, signature matrix) this shard owns, rows scanned).
+
+    owned_rows holds the owned rows of gallery.signatures() and is extended
+    in place. Identities are only ever appended, so only the rows from
+    scanned on need an owner lookup, and the matrix is sliced once per
+    gallery change instead of once per search.
+    """
+    identities, matrix = gallery.signatures()
+    owned_rows.extend(row for row in range(scanned, len(identities)) if ring.owner(identities[row]) == shard_id)
+    rows = np.asarray(owned_rows, dtype=np.intp)
+    return ([identities[row] for row in rows], matrix[rows]), len(identities)
+
+
+def _shard_main(shard_id, gallery_path, shard_ids, conn):
+    """Shard worker process: answers ping, search and stop requests on conn"""
+    # Shards already run in parallel as processes
+    cv2.setNumThreads(1)
+    gallery = Gallery(gallery_path)
+    ring = HashRing(shard_ids)
+    owned_rows = []
+    owned, scanned = _owned_signatures(gallery, ring, shard_id, owned_rows, 0)
+    conn.send((READY, True, None))
+
+    while True:
+        try:
+            request_id, op, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        if op == 'stop':
+            conn.send((request_id, True, None))
+            break
+        try:
+            if gallery.refresh():
+                owned, scanned = _owned_signatures(gallery, ring, shard_id, owned_rows, scanned)
+
+            if op == 'search':
+                probe, k, threshold, budget = payload
+                deadline = Deadline(budget)
+                result = search_gallery(gallery, probe, k, threshold, deadline, signatures=owned)
+                result['degradations'] = deadline.degradations
+            else:
+                result = {'identities': len(owned[0])}
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, str(e)))
+
+
+class _Shard:
+    """Coordinator-side handle of one shard worker process"""
+
+    def __init__(self, shard_id, context, gallery_path):
+        self.shard_id = shard_id
+        self.context = context
+        self.gallery_path = gallery_path
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.status = 'starting'
+        self.last_error = None
+        self.restarts = 0
+        self.ready = False
+        # (request id, monotonic time) of a timed out request the worker may still be working on
+        self.stale = None
+        self._request_ids = itertools.count()
+
+    def start(self, shard_ids):
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(target=_shard_main, name=f'gallery-shard-{self.shard_id}',
+                                            args=(self.shard_id, self.gallery_path, shard_ids, child),
+                                            daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.ready = False
+        self.stale = None
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=5):
+        if self.process is None:
+            return
+        try:
+            self.conn.send((next(self._request_ids), 'stop', None))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self.process = None
+
+    def restart(self, shard_ids, reason):
+        """Replace the worker process, e.g. one that died or is still busy long after its budget ran out"""
+        print(f"Restarting gallery shard {self.shard_id} ({reason})")
+        self.restarts += 1
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(1)
+            self.conn.close()
+        self.start(shard_ids)
+
+    def wait_ready(self, timeout):
+        """Wait up to timeout seconds for the worker to open the gallery; returns whether it is ready"""
+        end = time.monotonic() + timeout
+        with self.lock:
+            try:
+                while not self.ready:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0 or not self.alive():
+                        return False
+                    if self.conn.poll(min(remaining, 0.5)):
+                        self._receive()
+            except (EOFError, OSError):
+                return False
+            return True
+
+    def _receive(self):
+        """Read one message; returns (request id, ok, result) (call with self.lock held)"""
+        reply_id, ok, result = self.conn.recv()
+        if reply_id == READY:
+            self.ready = True
+        elif self.stale is not None and reply_id == self.stale[0]:
+            # The late reply of a timed out request: the worker is free again
+            self.stale = None
+        return reply_id, ok, result
+
+    def _state(self):
+        """
+        None when the worker can take a request right away, otherwise why
+        not: 'down', 'starting', 'busy' (still on a timed out request within
+        its budget) or 'hung' (past it). Never blocks (call with self.lock held).
+        """
+        if not self.alive():
+            return 'down'
+        try:
+            while self.conn.poll():
+                self._receive()
+        except (EOFError, OSError):
+            return 'down'
+        if self.stale is not None:
+            return 'hung' if time.monotonic() > self.stale[1] else 'busy'
+        return None if self.ready else 'starting'
+
+    def _round_trip(self, op, payload, timeout, budget=None):
+        """Send one request and wait up to timeout seconds for its reply (call with self.lock held)"""
+        request_id = next(self._request_ids)
+        sent = time.monotonic()
+        end = sent + timeout
+        self.conn.send((request_id, op, payload))
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                # The worker keeps going until the request's own budget runs out
+                self.stale = (request_id, sent + (timeout if budget is None else budget) + HUNG_GRACE)
+                raise ShardUnavailable(self.shard_id, 'timeout', f"no reply within {timeout:.1f}s")
+            reply_id, ok, result = self._receive()
+            if reply_id == request_id:
+                return ok, result
+
+    def call(self, op, payload, timeout, shard_ids, budget=None):
+        """
+        Send one request and wait up to timeout seconds for its reply.
+
+        A worker that is not ready for a request is reported without waiting;
+        one that died or is hung is restarted first and reported as starting.
+        """
+        with self.lock:
+            state = self._state()
+            if state in ('down', 'hung'):
+                if self.process is None:
+                    self.start(shard_ids)
+                elif state == 'down':
+                    self.restart(shard_ids, f"exit code {self.process.exitcode}")
+                else:
+                    self.restart(shard_ids, 'still busy after its budget ran out')
+                state = 'starting'
+            if state is not None:
+                self.status = state
+                self.last_error = {'starting': 'worker is starting',
+                                   'busy': 'still working on a request that timed out'}[state]
+                raise ShardUnavailable(self.shard_id, state, self.last_error)
+
+            try:
+                ok, result = self._round_trip(op, payload, timeout, budget)
+            except ShardUnavailable as e:
+                self.status = 'timeout'
+                self.last_error = str(e)
+                raise
+            except (EOFError, OSError) as e:
+                self.status = 'down'
+                self.last_error = str(e) or 'worker exited'
+                raise ShardUnavailable(self.shard_id, 'down', self.last_error)
+
+            if not ok:
+                self.status = 'error'
+                self.last_error = result
+                raise ShardUnavailable(self.shard_id, 'error', result)
+            self.status = 'ok'
+            return result
+
+    def ping(self, timeout):
+        """
+        Return (status, reply) without waiting behind a running request and
+        without restarting the worker: 'busy' when a request is in flight,
+        otherwise the _state() of a worker that cannot answer.
+        """
+        if not self.lock.acquire(blocking=False):
+            return 'busy', None
+        try:
+            state = self._state()
+            if state is not None:
+                return state, None
+            ok, result = self._round_trip('ping', None, timeout)
+            return ('ok', result) if ok else ('error', None)
+        except ShardUnavailable:
+            return 'timeout', None
+        except (EOFError, OSError):
+            return 'down', None
+        finally:
+            self.lock.release()
+
+
+class ShardedGallery:
+    """
+    Coordinator for a gallery split across shard worker processes.
+
+    search() scatters an extracted probe (utils.search.extract_probe) to all
+    shards and merges their top-k candidates; health() pings every shard.
+    """
+
+    def __init__(self, gallery_path, shards, timeout=DEFAULT_SHARD_TIMEOUT):
+        self.gallery_path = gallery_path
+        self.timeout = timeout
+        # Spawned, not forked: the coordinator runs inside a threaded web server.
+        # Spawned children re-run the main script as __mp_main__; app.py starts
+        # its services only outside that module name.
+        self._context = multiprocessing.get_context('spawn')
+        self._shards = [_Shard(shard_id, self._context, gallery_path) for shard_id in range(max(1, shards))]
+
+    def shard_ids(self):
+        return [shard.shard_id for shard in self._shards]
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        """Start every shard and wait up to timeout seconds for all of them to open the gallery"""
+        for shard in self._shards:
+            shard.start(self.shard_ids())
+        end = time.monotonic() + timeout
+        for shard in self._shards:
+            if not shard.wait_ready(max(end - time.monotonic(), 0)):
+                print(f"Gallery shard {shard.shard_id} is not ready after {timeout:.0f}s; searches skip it until it is")
+        return self
+
+    def stop(self):
+        for shard in self._shards:
+            shard.stop()
+
+    def _call_all(self, op, payload, timeout, budget=None):
+        shards = list(self._shards)
+        shard_ids = self.shard_ids()
+
+        def call(shard):
+            start = time.perf_counter()
+            try:
+                return shard, shard.call(op, payload, timeout, shard_ids, budget), None, time.perf_counter() - start
+            except ShardUnavailable as e:
+                return shard, None, e, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            return list(pool.map(call, shards))
+
+    def search(self, probe, k=DEFAULT_TOP_K, threshold=DEFAULT_THRESHOLD, deadline=None):
+        """Scatter probe to all shards, gather and merge their top-k candidates"""
+        k = min(max(1, k), MAX_TOP_K)
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = max(min(timeout, deadline.remaining()), 0)
+        # Shards stop early enough for their partial results to arrive within the timeout
+        budget = timeout - min(REPLY_MARGIN, 0.25 * timeout)
+
+        candidates = []
+        shard_reports = []
+        degradations = []
+        gallery_size = 0
+        for shard, result, error, seconds in self._call_all('search', (probe, k, threshold, budget), timeout, budget):
+            report = {'shard': shard.shard_id, 'status': shard.status, 'seconds': round(seconds, 4)}
+            if error is not None:
+                print(f"Gallery search: {error}")
+                report['error'] = str(error)
+            else:
+                candidates.extend(result['candidates'])
+                gallery_size += result['gallery_size']
+                degradations.extend(f"Shard {shard.shard_id}: {d}" for d in result['degradations'])
+                report.update({
+                    'gallery_size': result['gallery_size'],
+                    'full_matches': result['full_matches'],
+                    'early_terminated': result['early_terminated'],
+                    'stages': result['stages'],
+                })
+            shard_reports.append(report)
+
+        unavailable = [r['shard'] for r in shard_reports if r['status'] != 'ok']
+        if deadline is not None:
+            for description in degradations:
+                deadline.degrade(description)
+            if unavailable:
+                deadline.degrade(f"Results exclude unavailable shards {', '.join(map(str, unavailable))}")
+
+        return {
+            'candidates': heapq.nlargest(k, candidates, key=lambda c: c['score']),
+            'k': k,
+            'threshold': threshold,
+            'gallery_size': gallery_size,
+            'partial': bool(unavailable),
+            'shards': shard_reports,
+        }
+
+    def health(self, timeout=PING_TIMEOUT):
+        """Ping every idle shard; returns one status entry per shard and never blocks behind a search"""
+        shards = list(self._shards)
+
+        def ping(shard):
+            start = time.perf_counter()
+            status, result = shard.ping(timeout)
+            return shard, status, result, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            pings = list(pool.map(ping, shards))
+
+        report = []
+        for shard, status, result, seconds in pings:
+            report.append({
+                'shard': shard.shard_id,
+                'status': status,
+                'last_call': shard.status,
+                'pid': shard.process.pid if shard.process is not None else None,
+                'identities': result['identities'] if result else None,
+                'restarts': shard.restarts,
+                'latency_ms': round(seconds * 1000, 1),
+                'last_error': shard.last_error,
+            })
+        return report
@@ -0,0 +1,38 @@
+"""
+Cheap global fingerprint signature used to prefilter gallery searches: a
+downsampled orientation field, computed on a fixed-size copy of the image
+so probe and gallery signatures are comparable regardless of the original
+resolution.
+"""
+import cv2
+import numpy as np
+
+SIGNATURE_SIDE = 256
+SIGNATURE_GRID = 8
+# (cos 2θ, sin 2θ) per grid cell
+SIGNATURE_SIZE = SIGNATURE_GRID * SIGNATURE_GRID * 2
+
+
+def orientation_descriptor(gray):
+    """
+    Downsampled orientation field as a unit vector.
+
+    Each grid cell contributes the doubled-angle vector of its structure
+    tensor, weighted by its coherence, so the dot product of two
+    descriptors measures how similar the ridge flow is.
+    """
+    small = cv2.resize(gray, (SIGNATURE_SIDE, SIGNATURE_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    gx = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+
+    cell = SIGNATURE_SIDE // SIGNATURE_GRID
+    shape = (SIGNATURE_GRID, cell, SIGNATURE_GRID, cell)
+    gxx = (gx * gx).reshape(shape).sum(axis=(1, 3))
+    gyy = (gy * gy).reshape(shape).sum(axis=(1, 3))
+    gxy = (gx * gy).reshape(shape).sum(axis=(1, 3))
+
+    energy = gxx + gyy + 1e-6
+    vector = np.stack([(gxx - gyy) / energy, 2 * gxy / energy], axis=-1).ravel().astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
@@ -0,0 +1,273 @@
+import os
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TEMP_PREFIX = '.tmp_'
+# Held (flock) by the one process that sweeps; kept out of the sweep itself
+SWEEPER_LOCK = '.sweeper.lock'
+
+
+class StorageManager:
+    """
+    Lifecycle manager for the uploads/ and results/ folders.
+
+    Uploads are stored content-addressed (sha256 of the bytes), so the same
+    image uploaded twice is kept once. Access times are recorded in the file
+    atime with os.utime, which keeps the LRU state on disk and therefore
+    consistent between worker processes. A background thread evicts the
+    least-recently-used files down to max_bytes and removes anything not
+    accessed for max_age seconds. Files accessed within the last min_idle
+    seconds are never evicted; in_use() relies on that.
+
+    Every process may start the thread (e.g. each gunicorn worker after
+    fork); they elect one sweeper through a flock on SWEEPER_LOCK, and when
+    it exits the lock is released and another process takes over.
+    """
+
+    def __init__(self, upload_folder, results_folder, max_bytes=None, max_age=None,
+                 sweep_interval=60, min_idle=300):
+        self.upload_folder = upload_folder
+        self.results_folder = results_folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        # Files touched more recently than this are never evicted. This is what
+        # protects files used by a request in any process, so it must exceed the
+        # longest request (the compute budget plus upload time).
+        self.min_idle = min_idle
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(upload_folder, exist_ok=True)
+        os.makedirs(results_folder, exist_ok=True)
+
+    def save_upload(self, file_storage, original_filename, chunk_size=1024 * 1024):
+        """Save an uploaded file content-addressed and return its filename"""
+        ext = os.path.splitext(original_filename)[1].lower()
+        temp_path = os.path.join(self.upload_folder, f"{TEMP_PREFIX}{uuid.uuid4().hex}{ext}")
+
+        digest = hashlib.sha256()
+        stream = file_storage.stream
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+
+        return self._store(temp_path, digest.hexdigest(), ext, original_filename)
+
+    def save_bytes(self, data, ext, label):
+        """Save derived image bytes (e.g. a selected video frame) content-addressed like an upload"""
+        temp_path = os.path.join(self.upload_folder, f"{TEMP_PREFIX}{uuid.uuid4().hex}{ext}")
+        with open(temp_path, 'wb') as out:
+            out.write(data)
+        return self._store(temp_path, hashlib.sha256(data).hexdigest(), ext, label)
+
+    def _store(self, temp_path, hexdigest, ext, label):
+        filename = f"{hexdigest}{ext}"
+        final_path = os.path.join(self.upload_folder, filename)
+
+        with self._lock:
+            if os.path.exists(final_path):
+                print(f"Deduplicated upload {label} -> {filename}")
+            # Replace even when the file exists: the sweeper in another process may
+            # be removing the old copy right now, and the content is the same
+            os.replace(temp_path, final_path)
+            self.touch(final_path)
+
+        return filename
+
+    def touch(self, path):
+        """Record an access to path (updates atime, keeps mtime)"""
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def register(self, *paths):
+        """Register newly written artifacts so they start with a fresh access time"""
+        for path in paths:
+            if path:
+                self.touch(path)
+
+    @contextmanager
+    def in_use(self, *paths):
+        """
+        Mark paths as recently used for the duration of the block.
+
+        The access time is refreshed on entry and again on exit, so the files
+        stay inside the min_idle window while the block runs and for min_idle
+        seconds after it (long enough for the browser to fetch the images of
+        a result page). Eviction can run in another process (another
+        gunicorn worker), so the on-disk access time is the only guard that holds
+        across processes; min_idle must exceed the longest request.
+        """
+        keys = [os.path.abspath(p) for p in paths if p]
+        for key in keys:
+            self.touch(key)
+        try:
+            yield
+        finally:
+            for key in keys:
+                self.touch(key)
+
+    @contextmanager
+    def serving(self, folder, filename):
+        """
+        Mark a file as in use while a response for it is being created.
+
+        send_from_directory opens the file before returning, and an open file
+        stays readable after unlink, so this only has to cover that call.
+        """
+        with self.in_use(os.path.join(folder, filename)):
+            yield
+
+    def _scan(self):
+        entries = []
+        for folder in (self.upload_folder, self.results_folder):
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.name == SWEEPER_LOCK or not entry.is_file(follow_symlinks=False):
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        entries.append((entry.path, st.st_size, st.st_atime))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def _evict(self, path):
+        # Move the file aside first, so the access time checked below belongs to
+        # the file that gets removed: a request in another process may have
+        # replaced or touched it since the scan
+        doomed = os.path.join(os.path.dirname(path), f"{TEMP_PREFIX}evict_{uuid.uuid4().hex}")
+        try:
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Error evicting {path}: {str(e)}")
+            return False
+        try:
+            if time.time() - os.stat(doomed).st_atime < self.min_idle:
+                # Used since the scan; put it back (uploads are content-addressed and
+                # results uniquely named, so a copy stored meanwhile is identical)
+                os.replace(doomed, path)
+                return False
+            os.remove(doomed)
+        except OSError as e:
+            print(f"Error evicting {path}: {str(e)}")
+            return False
+        return True
+
+    def sweep(self):
+        """Run one eviction pass and return (files_removed, bytes_removed)"""
+        now = time.time()
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+
+        removed = 0
+        removed_bytes = 0
+        survivors = []
+
+        for path, size, atime in entries:
+            idle = now - atime
+            if os.path.basename(path).startswith(TEMP_PREFIX):
+                # Abandoned partial uploads
+                if idle > max(self.min_idle, 3600) and self._evict(path):
+                    removed += 1
+                    removed_bytes += size
+                    total -= size
+                continue
+            if idle < self.min_idle:
+                continue
+            if self.max_age is not None and idle > self.max_age:
+                if self._evict(path):
+                    removed += 1
+                    removed_bytes += size
+                    total -= size
+                continue
+            survivors.append((atime, path, size))
+
+        if self.max_bytes is not None and total > self.max_bytes:
+            survivors.sort()
+            for _, path, size in survivors:
+                if total <= self.max_bytes:
+                    break
+                if self._evict(path):
+                    removed += 1
+                    removed_bytes += size
+                    total -= size
+
+        if removed:
+            print(f"Storage sweep removed {removed} files ({removed_bytes} bytes), {total} bytes in use")
+        return removed, removed_bytes
+
+    def _elect(self, lock_file):
+        """True if this process is (or just became) the one that sweeps"""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _run(self):
+        # Opened in the sweeping thread so every process has its own lock
+        with open(os.path.join(self.upload_folder, SWEEPER_LOCK), 'a') as lock_file:
+            while not self._stop.wait(self.sweep_interval):
+                if not self._elect(lock_file):
+                    continue
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Storage sweep failed: {str(e)}")
+
+    def start(self):
+        """
+        Start the background eviction thread in this process (no-op if already
+        running). Do not call it in a process that forks workers afterwards;
+        start it in each worker instead.
+        """
+        if self.max_bytes is None and self.max_age is None:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='storage-eviction', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def storage_from_config(config):
+    """Create a StorageManager from a Flask config"""
+    return StorageManager(
+        config['UPLOAD_FOLDER'],
+        config['RESULTS_FOLDER'],
+        max_bytes=config.get('STORAGE_MAX_BYTES'),
+        max_age=config.get('STORAGE_MAX_AGE'),
+        sweep_interval=config.get('STORAGE_SWEEP_INTERVAL', 60),
+        min_idle=config.get('STORAGE_MIN_IDLE', 300),
+    )
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+
+def _ridge_pattern(subject, height, width):
+    """Ridge pattern shared by every impression of one synthetic finger"""
+    rng = np.random.default_rng(subject)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+
+    # Concentric ridges around a random core, bent by a smooth random field
+    cy = height * rng.uniform(0.35, 0.6)
+    cx = width * rng.uniform(0.35, 0.65)
+    radius = np.hypot((x - cx) * rng.uniform(0.8, 1.2), (y - cy) * rng.uniform(0.8, 1.2))
+
+    warp = np.zeros_like(radius)
+    for _ in range(4):
+        fx, fy = rng.uniform(0.005, 0.03, size=2)
+        phase = rng.uniform(0, 2 * np.pi)
+        warp += rng.uniform(3, 10) * np.sin(fx * x + fy * y + phase)
+
+    period = rng.uniform(7.0, 10.0)
+    ridges = np.sin(2 * np.pi * (radius + warp) / period)
+
+    # Scattered breaks and dots give each finger distinctive local features
+    for _ in range(rng.integers(25, 45)):
+        px, py = rng.integers(0, width), rng.integers(0, height)
+        cv2.circle(ridges, (int(px), int(py)), int(rng.integers(2, 5)), float(rng.choice([-1.0, 1.0])), -1)
+
+    return ridges
+
+
+def synthetic_fingerprint(subject, impression=0, size=(400, 320)):
+    """
+    Generate a synthetic fingerprint image (uint8, grayscale).
+
+    Images of the same subject share a ridge pattern; each impression adds
+    a different small rotation, shift, contrast change and sensor noise.
+    """
+    height, width = size
+    ridges = _ridge_pattern(subject, height, width)
+    rng = np.random.default_rng((subject + 1) * 1000003 + impression)
+
+    if impression:
+        angle = rng.uniform(-8, 8)
+        shift = rng.uniform(-10, 10, size=2)
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        matrix[:, 2] += shift
+        ridges = cv2.warpAffine(ridges, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+
+    image = 128 + 100 * ridges * rng.uniform(0.7, 1.0)
+    image += rng.normal(0, 8, size=image.shape)
+    image = cv2.GaussianBlur(image.astype(np.float32), (3, 3), 0)
+
+    # Elliptical finger area on a light background
+    mask = np.zeros((height, width), np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (int(width * 0.45), int(height * 0.47)), 0, 0, 360, 255, -1)
+    image[mask == 0] = 235
+
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_pair(seed, genuine=True, size=(400, 320)):
+    """Return two images of the same finger (genuine) or of different fingers"""
+    first = synthetic_fingerprint(seed, 0, size)
+    if genuine:
+        second = synthetic_fingerprint(seed, 1, size)
+    else:
+        second = synthetic_fingerprint(seed + 100000, 1, size)
+    return first, second
+
+
+def encode_png(image):
+    ok, buffer = cv2.imencode('.png', image)
+    if not ok:
+        raise ValueError("Failed to encode image")
+    return buffer.tobytes()
@@ -0,0 +1,172 @@
+"""
+Ten-print (multi-finger) record matching.
+
+A TenPrintRecord holds one extracted SIFT template per finger position, so
+each finger image is read and extracted once per record. compare_records()
+runs the per-finger comparisons concurrently on a thread pool (SIFT and
+FLANN release the GIL), fuses the per-finger scores into a record score
+and stops as soon as enough fingers agree on a high-confidence match,
+cancelling the comparisons that have not started yet.
+
+Jobs that already run cannot be cancelled, so each one sizes its own work
+to the deadline when it starts: the finger image is downscaled before
+extraction and the keypoints are capped before matching, so that no job
+keeps a pool thread busy long after the request has given up.
+"""
+import concurrent.futures
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from utils.deadline import COST_MODEL, MIN_KEYPOINTS, DeadlineExceeded, check, pixel_budget
+from utils.match_fingerprint import MATCH_THRESHOLD, extract_sift_features, match_descriptors, calculate_match_score, downscale_to
+from utils.profiling import stage, submit
+
+# ANSI/NIST-ITL finger position codes 1-10
+FINGER_POSITIONS = {
+    1: 'right_thumb', 2: 'right_index', 3: 'right_middle', 4: 'right_ring', 5: 'right_little',
+    6: 'left_thumb', 7: 'left_index', 8: 'left_middle', 9: 'left_ring', 10: 'left_little',
+}
+FINGER_NAMES = list(FINGER_POSITIONS.values())
+
+# Stop once this many fingers score at or above MATCH_THRESHOLD
+AGREEMENT_FINGERS = 3
+# The record score is the mean of the best this-many finger scores
+FUSION_FINGERS = 3
+
+# Share of the remaining budget one pool job may plan to use when it starts
+JOB_SHARE = 0.5
+
+# descriptors are ordered strongest keypoint first, so capping is a slice
+FingerTemplate = namedtuple('FingerTemplate', 'keypoint_count descriptors')
+
+
+def extract_finger(image_path, deadline=None, finger='finger'):
+    """Read one finger image and extract its SIFT template, downscaled if SIFT would not fit the deadline"""
+    check(deadline, 'feature extraction')
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Could not read image from {image_path}")
+
+    if deadline is not None and not deadline.fits(COST_MODEL['sift_per_mp'] * gray.size / 1e6, share=JOB_SHARE):
+        gray = downscale_to(gray, pixel_budget(deadline, JOB_SHARE, COST_MODEL['sift_per_mp']))
+        deadline.degrade(f"Downscaled {finger} to {gray.shape[1]}x{gray.shape[0]}")
+
+    with stage('sift'):
+        keypoints, descriptors = extract_sift_features(gray)
+    if descriptors is not None:
+        descriptors = descriptors[np.argsort([-kp.response for kp in keypoints], kind='stable')]
+    return FingerTemplate(len(keypoints), descriptors)
+
+
+def _timeout(deadline):
+    return None if deadline is None else max(deadline.remaining(), 0)
+
+
+class TenPrintRecord:
+    """Extracted templates of a multi-finger record, keyed by finger name"""
+
+    def __init__(self, fingers=None):
+        self.fingers = dict(fingers or {})
+
+    @classmethod
+    def from_images(cls, image_paths, executor, deadline=None):
+        """Extract {finger name: image path} concurrently on executor"""
+        unknown = set(image_paths) - set(FINGER_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown finger positions: {', '.join(sorted(unknown))}")
+
+        futures = {finger: submit(executor, extract_finger, path, deadline, finger) for finger, path in image_paths.items()}
+        try:
+            concurrent.futures.wait(futures.values(), timeout=_timeout(deadline))
+            check(deadline, 'feature extraction')
+            return cls({finger: future.result() for finger, future in futures.items()})
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+    def positions(self):
+        return [finger for finger in FINGER_NAMES if finger in self.fingers]
+
+
+def compare_fingers(probe, reference, deadline=None, finger='finger'):
+    """
+    Return (score, good matches count) for two FingerTemplates.
+
+    When matching would not fit the deadline only the strongest keypoints
+    are matched; the score stays relative to all keypoints, as in
+    match_fingerprint, so a capped comparison can only read low.
+    """
+    check(deadline, 'ten-print matching')
+    if probe.descriptors is None or reference.descriptors is None or len(reference.descriptors) < 2:
+        return 0.0, 0
+
+    probe_descriptors, reference_descriptors = probe.descriptors, reference.descriptors
+    per_query = COST_MODEL['match_per_query'] * np.log2(len(reference_descriptors) + 1)
+    if deadline is not None and not deadline.fits(per_query * len(probe_descriptors), share=JOB_SHARE):
+        limit = max(MIN_KEYPOINTS, int(deadline.remaining() * JOB_SHARE / per_query))
+        probe_descriptors, reference_descriptors = probe_descriptors[:limit], reference_descriptors[:limit]
+        deadline.degrade(f"Capped {finger} keypoints at the {limit} strongest")
+
+    with stage('match'):
+        good_matches_count = len(match_descriptors(probe_descriptors, reference_descriptors))
+    return calculate_match_score(good_matches_count, probe.keypoint_count, reference.keypoint_count), good_matches_count
+
+
+def fuse_scores(scores, fingers=FUSION_FINGERS):
+    """Record score: mean of the best finger scores, so a few poor captures do not sink a genuine record"""
+    if not scores:
+        return 0.0
+    best = sorted(scores, reverse=True)[:fingers]
+    return sum(best) / len(best)
+
+
+def compare_records(probe, reference, executor, deadline=None, agreement=AGREEMENT_FINGERS):
+    """
+    Compare the finger positions present in both records concurrently.
+
+    Returns a dict with the fused record score and per-finger results.
+    Fingers left unscored because of the short-circuit are reported as
+    skipped. Raises DeadlineExceeded if the comparisons outlive the deadline.
+    """
+    fingers = [finger for finger in probe.positions() if finger in reference.fingers]
+    if not fingers:
+        raise ValueError("The records have no finger positions in common")
+
+    futures = {submit(executor, compare_fingers, probe.fingers[finger], reference.fingers[finger], deadline, finger): finger
+               for finger in fingers}
+    results = {}
+    short_circuited = False
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=_timeout(deadline)):
+            score, good_matches_count = future.result()
+            results[futures[future]] = (score, good_matches_count)
+
+            agreeing = sum(1 for s, _ in results.values() if s >= MATCH_THRESHOLD)
+            if agreeing >= agreement and len(results) < len(fingers):
+                short_circuited = True
+                break
+    except concurrent.futures.TimeoutError:
+        raise DeadlineExceeded('ten-print matching', deadline.elapsed())
+    finally:
+        for future in futures:
+            future.cancel()
+
+    scores = [score for score, _ in results.values()]
+    finger_results = []
+    for finger in fingers:
+        if finger in results:
+            score, good_matches_count = results[finger]
+            finger_results.append({'finger': finger, 'status': 'compared',
+                                   'score': round(score, 2), 'good_matches': good_matches_count})
+        else:
+            finger_results.append({'finger': finger, 'status': 'skipped'})
+
+    return {
+        'score': round(fuse_scores(scores), 2),
+        'fingers': finger_results,
+        'compared': len(results),
+        'agreeing_fingers': sum(1 for score in scores if score >= MATCH_THRESHOLD),
+        'short_circuited': short_circuited,
+    }
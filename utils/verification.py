@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from utils.deadline import check
+from utils.match_fingerprint import create_flann_matcher, extract_sift_features, ratio_test, calculate_match_score
+from utils.profiling import stage
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class EnrolledTemplate:
+    """An enrolled identity's descriptors with a FLANN index already trained on them"""
+
+    def __init__(self, identity, keypoint_count, descriptors):
+        self.identity = identity
+        self.keypoint_count = keypoint_count
+        self.matcher = None
+        # FLANN needs at least two train descriptors for a 2-NN ratio test
+        if len(descriptors) >= 2:
+            self.matcher = create_flann_matcher()
+            self.matcher.add([descriptors])
+            self.matcher.train()
+        # A trained matcher is not documented as thread safe, so queries are serialized per template
+        self._lock = threading.Lock()
+
+    def match(self, probe_descriptors):
+        """Return the probe matches that pass the ratio test"""
+        if self.matcher is None or probe_descriptors is None or len(probe_descriptors) == 0:
+            return []
+        with self._lock:
+            return ratio_test(self.matcher.knnMatch(probe_descriptors, k=2))
+
+
+class EnrollmentCache:
+    """
+    Bounded LRU cache of EnrolledTemplates built from a gallery.
+
+    Entries are keyed by the identity's gallery record, so re-enrolling an
+    identity makes the next lookup build a fresh template instead of serving
+    the superseded one.
+    """
+
+    def __init__(self, gallery, capacity=DEFAULT_CACHE_SIZE):
+        self.gallery = gallery
+        self.capacity = max(1, capacity)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, identity):
+        """Return (template, cache hit) for identity; raises KeyError if it is not enrolled"""
+        key = (identity, self.gallery.record_offset(identity))
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return template, True
+            self.misses += 1
+
+        # Build outside the lock; a concurrent miss for the same identity just builds it twice
+        keypoints, descriptors = self.gallery.get_float32(identity)
+        template = EnrolledTemplate(identity, len(keypoints), descriptors)
+
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return template, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def verify_image(cache, identity, image_path, deadline=None):
+    """
+    1:1 verification of the probe at image_path against the enrolled identity.
+
+    Only the probe is extracted; the enrolled side comes from the cache.
+    Returns (score, probe keypoint count, enrolled keypoint count, good matches count, cache hit).
+    """
+    with stage('template'):
+        template, cache_hit = cache.get(identity)
+
+    with stage('read'):
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Could not read image from {image_path}")
+
+    with stage('sift'):
+        keypoints, descriptors = extract_sift_features(gray)
+    check(deadline, 'feature extraction')
+
+    with stage('match'):
+        good_matches = template.match(descriptors)
+    check(deadline, 'matching')
+
+    score = calculate_match_score(len(good_matches), len(keypoints), template.keypoint_count)
+    return score, len(keypoints), template.keypoint_count, len(good_matches), cache_hit